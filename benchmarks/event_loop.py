@@ -0,0 +1,54 @@
+"""
+Compares scan throughput on the default asyncio event loop and on uvloop.
+
+    python -m benchmarks.event_loop --targets 2000 --max-connections 500
+"""
+
+import argparse
+import time
+
+from benchmarks.standin import StandIn
+from jarm.loop.loop import EventLoop
+from jarm.scanner.scanner import Scanner
+
+
+async def scan(port: int, targets: int, max_connections: int) -> int:
+    count = 0
+    async for _ in Scanner.scan_many(
+        (("127.0.0.1", port) for _ in range(targets)),
+        max_connections=max_connections,
+        timeout=10,
+    ):
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--targets", type=int, default=1000)
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    loops = [("asyncio", False)]
+    if EventLoop.fast_loop_factory() is not None:
+        loops.append(("uvloop", True))
+    else:
+        print("uvloop is not installed, only the default event loop is measured")
+
+    with StandIn() as server:
+        print(f"{'loop':<10}{'probes/s':>12}{'best':>12}")
+        for name, fast in loops:
+            rates = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                EventLoop.run(
+                    scan(server.ports[0], args.targets, args.max_connections),
+                    fast=fast,
+                )
+                rates.append(10 * args.targets / (time.perf_counter() - start))
+            print(f"{name:<10}{sum(rates) / len(rates):>12.0f}{max(rates):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Microbenchmarks of the CPU bound stages every probe goes through.
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --filter parse --repeat 10
+    python -m benchmarks.micro --profile scan.pstats --folded scan.folded
+
+Each case is timed with timeit and reported as the best time per call over --repeat
+runs. The server hello corpus holds the responses of the test recordings and stand-in
+answers to every V1 probe.
+
+--profile runs the per target pipeline (build the probes, parse the answers and hash
+them) --targets times under cProfile and writes the pstats file. --folded samples the
+same pipeline on a CPU time interval timer and writes folded stacks, one
+"frame;frame;frame count" line per stack, which flamegraph.pl and speedscope read.
+"""
+
+import argparse
+import cProfile
+import glob
+import json
+import os
+import pstats
+import signal
+import timeit
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.standin import server_hello
+from jarm.formats import V1
+from jarm.hashing.hashing import Hasher
+from jarm.packet.template import PacketTemplate
+from jarm.scanner.scanner import Scanner
+
+HOST = "example.com"
+DATA = os.path.join(os.path.dirname(os.path.dirname(__file__)), "tests", "data")
+
+
+def corpus() -> List[bytes]:
+    """
+    Returns the ServerHello records of the test recordings and the stand-in answers to
+    every V1 probe.
+    """
+    hellos = []
+    for path in sorted(glob.glob(os.path.join(DATA, "*.json"))):
+        with open(path) as recording:
+            for ports in json.load(recording).values():
+                for entries in ports.values():
+                    for entry in entries.values():
+                        response = bytes.fromhex(entry["response"].replace(" ", ""))
+                        if response.startswith(b"\x16"):
+                            hellos.append(response)
+    for _, packet in Scanner._generate_packets(HOST, 443):
+        hellos.append(server_hello(packet))
+    return hellos
+
+
+def scan_target(hellos: List[bytes]) -> str:
+    """
+    The CPU work of scanning one target: build the probes, parse the answers, hash.
+    """
+    packets = Scanner._generate_packets(HOST, 443)
+    results = [
+        Scanner._parse_server_hello(hellos[i % len(hellos)], packet)
+        for i, packet in enumerate(packets)
+    ]
+    return Hasher.jarm(",".join(results))
+
+
+def cases() -> Dict[str, Tuple[Callable[[], object], int]]:
+    """
+    Returns the benchmark cases by name, with the number of operations of one call.
+    """
+    hellos = corpus()
+    raw = [
+        ",".join(
+            Scanner._read_server_hello(hellos[(i + j) % len(hellos)]) for j in range(10)
+        )
+        for i in range(len(hellos))
+    ]
+    benchmarks: Dict[str, Tuple[Callable[[], object], int]] = {}
+    for f in V1:
+        packet = f().build_packet(HOST, 443)
+        template = PacketTemplate.for_format(f)
+        benchmarks[f"Packet.build[{f.__name__}]"] = (packet.build, 1)
+        benchmarks[f"PacketTemplate.build[{f.__name__}]"] = (
+            lambda template=template: template.build(HOST),
+            1,
+        )
+    benchmarks["Scanner._generate_packets"] = (
+        lambda: Scanner._generate_packets(HOST, 443),
+        1,
+    )
+    source = ("", b"")
+    benchmarks["Scanner._parse_server_hello"] = (
+        lambda: [Scanner._parse_server_hello(h, source) for h in hellos],
+        len(hellos),
+    )
+    benchmarks["Scanner._read_server_hello"] = (
+        lambda: [Scanner._read_server_hello(h) for h in hellos],
+        len(hellos),
+    )
+    benchmarks["Hasher.jarm"] = (lambda: [Hasher.jarm(r) for r in raw], len(raw))
+    benchmarks["Hasher.jarm_batch"] = (lambda: Hasher.jarm_batch(raw), len(raw))
+    benchmarks["scan_target"] = (lambda: scan_target(hellos), 1)
+    return benchmarks
+
+
+def run(pattern: Optional[str], repeat: int):
+    print(f"{'case':<48}{'per call':>12}{'calls/s':>14}")
+    for name, (function, operations) in cases().items():
+        if pattern and pattern not in name:
+            continue
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number)) / number / operations
+        print(f"{name:<48}{best * 1e6:>10.2f}us{1 / best:>14.0f}")
+
+
+def profile(path: str, targets: int):
+    hellos = corpus()
+    profiler = cProfile.Profile()
+    profiler.runcall(lambda: [scan_target(hellos) for _ in range(targets)])
+    profiler.dump_stats(path)
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+
+def folded(path: str, targets: int, interval: float = 0.001):
+    """
+    Samples the stack of the pipeline every interval seconds of CPU time and writes
+    folded stacks. Uses SIGPROF, so it only runs on Unix.
+    """
+    hellos = corpus()
+    stacks: Counter = Counter()
+
+    def sample(signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            name = os.path.basename(code.co_filename)
+            stack.append(f"{code.co_name} ({name}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stacks[";".join(reversed(stack))] += 1
+
+    previous = signal.signal(signal.SIGPROF, sample)
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+    try:
+        for _ in range(targets):
+            scan_target(hellos)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+    with open(path, "w") as out:
+        for stack, count in stacks.most_common():
+            out.write(f"{stack} {count}\n")
+    print(f"{sum(stacks.values())} samples of {len(stacks)} stacks written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", help="Only run the cases containing this text.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--profile", help="Write cProfile stats to this file.")
+    parser.add_argument("--folded", help="Write sampled folded stacks to this file.")
+    parser.add_argument(
+        "--targets",
+        type=int,
+        default=10000,
+        help="Targets run through the pipeline when profiling (default is 10000).",
+    )
+    args = parser.parse_args()
+    if args.profile:
+        profile(args.profile, args.targets)
+    if args.folded:
+        folded(args.folded, args.targets)
+    if not args.profile and not args.folded:
+        run(args.filter, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+A local TLS stand-in server for benchmarks.
+
+It answers every ClientHello with a ServerHello record picking the first cipher suite
+offered, without completing the handshake, which is all a JARM probe reads. The server
+runs in its own process so that it does not compete with the scanner for the GIL.
+
+A farm of several listeners can misbehave like real servers: answer late, drop
+connections without answering (as if the packets were lost), reset them or drip the
+response a few bytes at a time.
+"""
+
+import asyncio
+import multiprocessing
+import random
+import socket
+from struct import pack
+from typing import Any, Dict, List, Optional
+
+# Cipher suites and versions reserved by GREASE, never selected
+GREASE = {bytes((b, b)) for b in range(0x0A, 0x100, 0x10)}
+
+
+def server_hello(client_hello: bytes) -> bytes:
+    """
+    Builds the ServerHello record answering a ClientHello record.
+    """
+    # Record header (5), handshake header (4), version (2) and random (32)
+    offset = 43
+    offset += 1 + client_hello[offset]
+    length = int.from_bytes(client_hello[offset : offset + 2], "big")
+    ciphers = client_hello[offset + 2 : offset + 2 + length]
+    cipher = next(
+        (
+            ciphers[i : i + 2]
+            for i in range(0, len(ciphers), 2)
+            if ciphers[i : i + 2] not in GREASE
+        ),
+        b"\xc0\x2f",
+    )
+    # Renegotiation info, then extended master secret
+    extensions = b"\xff\x01\x00\x01\x00\x00\x17\x00\x00"
+    body = (
+        b"\x03\x03"
+        + bytes(range(32))
+        + b"\x00"
+        + cipher
+        + b"\x00"
+        + pack("!H", len(extensions))
+        + extensions
+    )
+    handshake = b"\x02" + len(body).to_bytes(3, "big") + body
+    return b"\x16\x03\x03" + pack("!H", len(handshake)) + handshake
+
+
+class Behaviour:
+    """
+    How the stand-in answers, picked at random for every connection.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        loss: float = 0.0,
+        reset: float = 0.0,
+        drip: float = 0.0,
+        drip_size: int = 16,
+    ):
+        """
+        Args:
+            latency (float, optional, default=0.0):
+                Seconds to wait before answering the ClientHello.
+            loss (float, optional, default=0.0):
+                Share of connections that never get an answer.
+            reset (float, optional, default=0.0):
+                Share of connections reset instead of answered.
+            drip (float, optional, default=0.0):
+                Seconds to wait between each drip_size bytes of the answer, 0 sends it
+                at once.
+            drip_size (int, optional, default=16):
+                Bytes sent at a time when dripping.
+        """
+        self.latency = latency
+        self.loss = loss
+        self.reset = reset
+        self.drip = drip
+        self.drip_size = drip_size
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+    def __str__(self):
+        return ", ".join(f"{k}={v}" for k, v in vars(self).items() if v) or "clean"
+
+
+def abort(writer: asyncio.StreamWriter):
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, pack("ii", 1, 0))
+    writer.transport.abort()
+
+
+def handler(behaviour: Behaviour, rng: random.Random):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            header = await reader.readexactly(5)
+            record = header + await reader.readexactly(
+                int.from_bytes(header[3:5], "big")
+            )
+            roll = rng.random()
+            if roll < behaviour.reset:
+                abort(writer)
+                return
+            if roll < behaviour.reset + behaviour.loss:
+                # Wait for the scanner to time out
+                await reader.read()
+                return
+            if behaviour.latency:
+                await asyncio.sleep(behaviour.latency)
+            answer = server_hello(record)
+            if behaviour.drip:
+                for i in range(0, len(answer), behaviour.drip_size):
+                    writer.write(answer[i : i + behaviour.drip_size])
+                    await writer.drain()
+                    await asyncio.sleep(behaviour.drip)
+            else:
+                writer.write(answer)
+                await writer.drain()
+            # The scanner closes the connection once it read the ServerHello
+            await reader.read()
+        except (asyncio.IncompleteReadError, ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def serve(ports: Any, listeners: int, host: str, behaviour: Dict[str, Any]):
+    handle = handler(Behaviour(**behaviour), random.Random(1484))
+    servers = [
+        await asyncio.start_server(handle, host, 0, backlog=4096)
+        for _ in range(listeners)
+    ]
+    ports.put([server.sockets[0].getsockname()[1] for server in servers])
+    await asyncio.Event().wait()
+
+
+def run(ports: Any, listeners: int, host: str, behaviour: Dict[str, Any]):
+    asyncio.run(serve(ports, listeners, host, behaviour))
+
+
+class StandIn:
+    """
+    Runs a farm of stand-in listeners in a child process, as a context manager.
+    """
+
+    def __init__(
+        self,
+        listeners: int = 1,
+        host: str = "127.0.0.1",
+        behaviour: Optional[Behaviour] = None,
+    ):
+        self.listeners = listeners
+        self.host = host
+        self.behaviour = behaviour or Behaviour()
+        self.ports: List[int] = []
+        self._process: Optional[multiprocessing.Process] = None
+
+    def __enter__(self) -> "StandIn":
+        ports: Any = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=run,
+            args=(ports, self.listeners, self.host, self.behaviour.as_dict()),
+            daemon=True,
+        )
+        self._process.start()
+        self.ports = ports.get(timeout=10)
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
@@ -0,0 +1,172 @@
+"""
+Measures scan throughput against a farm of local stand-in servers.
+
+    python -m benchmarks.throughput --targets 2000 --listeners 8 --max-connections 500
+
+Every scenario runs in a fresh process and reports probes per second, the p50 and
+p99 time to scan one target, the peak RSS and the CPU time per target of the scanning
+process. With --cli the targets are scanned by the jarm command line instead, which
+reports no per target latency.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.standin import Behaviour, StandIn
+from jarm.constants import TOTAL_FAILURE
+from jarm.hashing.hashing import Hasher
+from jarm.loop.loop import EventLoop
+from jarm.scanner.scanner import Scanner
+
+SCENARIOS = {
+    "clean": Behaviour(),
+    "latency": Behaviour(latency=0.05),
+    "lossy": Behaviour(loss=0.02),
+    "resets": Behaviour(reset=0.05),
+    "drip": Behaviour(drip=0.005),
+}
+
+
+def quantile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def scan(ports: List[int], args: argparse.Namespace) -> Dict[str, Any]:
+    started: Dict[str, float] = {}
+    latencies = []
+    failures = 0
+
+    def targets():
+        for i in range(args.targets):
+            host = f"target{i}.bench"
+            # Taken lazily, so this is when the target starts being scanned
+            started[host] = time.perf_counter()
+            yield host, ports[i % len(ports)], "127.0.0.1"
+
+    async for jarm, host, _ in Scanner.scan_many(
+        targets(),
+        max_connections=args.max_connections,
+        timeout=args.timeout,
+        suppress=True,
+    ):
+        latencies.append(time.perf_counter() - started.pop(host))
+        if jarm == Hasher.jarm(TOTAL_FAILURE):
+            failures += 1
+    return {
+        "p50": quantile(latencies, 0.5),
+        "p99": quantile(latencies, 0.99),
+        "failures": failures,
+    }
+
+
+def scan_cli(ports: List[int], args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as targets:
+        for i in range(args.targets):
+            targets.write(f"127.0.0.1:{ports[i % len(ports)]}\n")
+    command = [sys.executable, "-c", "from jarm.cli import run; run()"]
+    command += ["-i", targets.name, "--suppress", "--timeout", str(args.timeout)]
+    command += ["-w", str(args.max_connections // 2)]
+    command += ["--max-connections", str(args.max_connections)]
+    if args.fast_loop:
+        command.append("--fast-loop")
+    try:
+        output = subprocess.run(
+            command, check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+    finally:
+        os.unlink(targets.name)
+    return {
+        "p50": None,
+        "p99": None,
+        "failures": output.count(f"JARM: {Hasher.jarm(TOTAL_FAILURE)}"),
+    }
+
+
+def measure(name: str, args: argparse.Namespace, results: Any):
+    """
+    Runs one scenario, in its own process so that RSS and CPU are its own.
+    """
+    with StandIn(args.listeners, behaviour=SCENARIOS[name]) as farm:
+        who = resource.RUSAGE_CHILDREN if args.cli else resource.RUSAGE_SELF
+        before = resource.getrusage(who)
+        start = time.perf_counter()
+        if args.cli:
+            result = scan_cli(farm.ports, args)
+        else:
+            result = EventLoop.run(scan(farm.ports, args), fast=args.fast_loop)
+        elapsed = time.perf_counter() - start
+        after = resource.getrusage(who)
+    cpu = (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+    results.put(
+        {
+            "scenario": name,
+            "targets": args.targets,
+            "probes_per_second": 10 * args.targets / elapsed,
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_mb": after.ru_maxrss / 1024,
+            "cpu_ms_per_target": 1000 * cpu / args.targets,
+            **result,
+        }
+    )
+
+
+def milliseconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="Scenario to run, may be repeated (default is all of them).",
+    )
+    parser.add_argument("--targets", type=int, default=500)
+    parser.add_argument("--listeners", type=int, default=8)
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--timeout", type=int, default=2)
+    parser.add_argument("--fast-loop", action="store_true")
+    parser.add_argument(
+        "--cli", action="store_true", help="Scan through the command line."
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print one JSON object per scenario."
+    )
+    args = parser.parse_args()
+
+    if not args.json:
+        print(
+            f"{'scenario':<10}{'probes/s':>10}{'p50':>10}{'p99':>10}"
+            f"{'rss':>10}{'cpu/target':>12}{'failed':>8}"
+        )
+    for name in args.scenario or SCENARIOS:
+        results: Any = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measure, args=(name, args, results))
+        process.start()
+        result = results.get()
+        process.join()
+        if args.json:
+            print(json.dumps(result))
+            continue
+        print(
+            f"{name:<10}{result['probes_per_second']:>10.0f}"
+            f"{milliseconds(result['p50']):>10}{milliseconds(result['p99']):>10}"
+            f"{result['peak_rss_mb']:>8.1f}MB"
+            f"{result['cpu_ms_per_target']:>10.2f}ms{result['failures']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import sqlite3
+import time
+from typing import Optional, Tuple
+
+# A JARM hash made only of zeros means every probe failed
+FAILURE_HASH: str = "0" * 62
+
+CacheKey = Tuple[str, int, str]
+
+
+class ResultCache(ABC):
+    """
+    Base class for JARM result caches. Backends implement _get and _set.
+
+    Results are keyed by host, port and the IP address the host resolved to, so a host
+    moving to new infrastructure is scanned again. Results where every probe failed are
+    kept for negative_ttl seconds instead of ttl.
+    """
+
+    def __init__(self, ttl: float = 86400, negative_ttl: float = 3600):
+        """
+        Initializes a result cache.
+
+        Args:
+            ttl (float, optional, default=86400):
+                How long, in seconds, a JARM result is kept.
+            negative_ttl (float, optional, default=3600):
+                How long, in seconds, a result where every probe failed is kept.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def get(self, host: str, port: int, ip: Optional[str] = None) -> Optional[str]:
+        """
+        Returns the cached JARM hash for a target, or None if there is no fresh entry.
+        """
+        return self._get((host, port, ip or ""), time.time())
+
+    def set(self, host: str, port: int, ip: Optional[str], jarm: str):
+        """
+        Stores the JARM hash of a target.
+        """
+        ttl = self.negative_ttl if jarm == FAILURE_HASH else self.ttl
+        if ttl > 0:
+            self._set((host, port, ip or ""), jarm, time.time() + ttl)
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def _get(self, key: CacheKey, now: float) -> Optional[str]:
+        """
+        Returns the JARM hash stored for key if it expires after now.
+        """
+
+    @abstractmethod
+    def _set(self, key: CacheKey, jarm: str, expires: float):
+        """
+        Stores the JARM hash for key until expires.
+        """
+
+
+class MemoryCache(ResultCache):
+    """
+    An in-memory least recently used result cache.
+    """
+
+    def __init__(
+        self, ttl: float = 86400, negative_ttl: float = 3600, max_entries: int = 100000
+    ):
+        super().__init__(ttl=ttl, negative_ttl=negative_ttl)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, Tuple[str, float]]" = OrderedDict()
+
+    def _get(self, key: CacheKey, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _set(self, key: CacheKey, jarm: str, expires: float):
+        self._entries[key] = (jarm, expires)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SQLiteCache(ResultCache):
+    """
+    A result cache stored in a SQLite database, shared between runs.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400, negative_ttl: float = 3600):
+        super().__init__(ttl=ttl, negative_ttl=negative_ttl)
+        self.path = path
+        self._db = sqlite3.connect(path, isolation_level=None)
+        # Writes are small and frequent, do not fsync each one
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jarm_cache ("
+            "host TEXT NOT NULL, port INTEGER NOT NULL, ip TEXT NOT NULL, "
+            "jarm TEXT NOT NULL, expires REAL NOT NULL, PRIMARY KEY (host, port, ip))"
+        )
+
+    def _get(self, key: CacheKey, now: float) -> Optional[str]:
+        row = self._db.execute(
+            "SELECT jarm FROM jarm_cache WHERE host = ? AND port = ? AND ip = ? "
+            "AND expires > ?",
+            (*key, now),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: CacheKey, jarm: str, expires: float):
+        self._db.execute(
+            "INSERT OR REPLACE INTO jarm_cache (host, port, ip, jarm, expires) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (*key, jarm, expires),
+        )
+
+    def __reduce__(self):
+        # A copy sent to another process opens its own connection to the database
+        return (SQLiteCache, (self.path, self.ttl, self.negative_ttl))
+
+    def purge(self):
+        """
+        Deletes expired entries.
+        """
+        self._db.execute("DELETE FROM jarm_cache WHERE expires <= ?", (time.time(),))
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,274 @@
+import multiprocessing
+import os
+from struct import Struct
+import time
+from typing import BinaryIO, Iterator, List, Optional, Sequence, Tuple
+import zlib
+
+from jarm.exceptions.exceptions import PyJARMInvalidCapture
+from jarm.hashing.hashing import Hasher
+
+# A target read back from a capture: host, port, ip, capture time and the raw responses
+CapturedTarget = Tuple[str, int, Optional[str], float, List[bytes]]
+
+
+class HelloCapture:
+    """
+    An append-only file of the raw ServerHellos of scanned targets, so that JARM hashes
+    can be computed again offline, for example after a parser change.
+
+    The file starts with MAGIC and holds one record per target: a sync marker, its
+    length and checksum, the capture time, port, host, IP address and the response to
+    every probe in V1 order. Each record is appended with a single write, so several
+    processes can share a capture. A record cut short by a crash fails its checksum and
+    is skipped when reading, which picks up again at the next sync marker.
+    """
+
+    MAGIC = b"JARMCAP2"
+    SYNC = b"JREC"
+    # Sync marker, record length and CRC32 of the record
+    RECORD = Struct("!4sII")
+    # Capture time, port, host length, IP address length and number of responses
+    HEADER = Struct("!dHHBB")
+    # Response length
+    RESPONSE = Struct("!H")
+
+    def __init__(self, path: str):
+        """
+        Opens a capture file for appending, creating it if it does not exist.
+
+        Args:
+            path (str):
+                The capture file.
+        """
+        self.path = path
+        self._fd: Optional[int] = os.open(
+            path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+        )
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, HelloCapture.MAGIC)
+        else:
+            HelloCapture._check_magic(path)
+
+    def __reduce__(self):
+        # A copy sent to another process opens the file again
+        return (HelloCapture, (self.path,))
+
+    def write(
+        self, host: str, port: int, ip: Optional[str], responses: Sequence[bytes]
+    ):
+        """
+        Appends the responses to the probes of a target.
+        """
+        if self._fd is None:
+            raise ValueError("Capture is closed")
+        host_bytes = host.encode()
+        ip_bytes = (ip or "").encode()
+        parts = [
+            HelloCapture.HEADER.pack(
+                time.time(), port, len(host_bytes), len(ip_bytes), len(responses)
+            ),
+            host_bytes,
+            ip_bytes,
+        ]
+        for response in responses:
+            response = (response or b"")[:0xFFFF]
+            parts.append(HelloCapture.RESPONSE.pack(len(response)))
+            parts.append(response)
+        body = b"".join(parts)
+        os.write(
+            self._fd,
+            HelloCapture.RECORD.pack(HelloCapture.SYNC, len(body), zlib.crc32(body))
+            + body,
+        )
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @staticmethod
+    def read(
+        path: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Iterator[CapturedTarget]:
+        """
+        Yields every target of a capture file, or of the records between the start and
+        end offsets.
+
+        Args:
+            path (str):
+                The capture file.
+            start (int, optional):
+                Offset of the first record, see offsets.
+            end (int, optional):
+                Offset after the last record.
+        Returns:
+            :iterator:
+                Yields a (host, port, ip, capture time, responses) tuple per target.
+                ip is None for targets resolved by a proxy.
+        """
+        with open(path, "rb") as capture:
+            if start is None:
+                HelloCapture._check_magic(path)
+                start = len(HelloCapture.MAGIC)
+            capture.seek(start)
+            data = capture.read() if end is None else capture.read(end - start)
+        view = memoryview(data)
+        offset = 0
+        while offset + HelloCapture.RECORD.size <= len(data):
+            sync, length, checksum = HelloCapture.RECORD.unpack_from(view, offset)
+            body = offset + HelloCapture.RECORD.size
+            if (
+                sync == HelloCapture.SYNC
+                and body + length <= len(data)
+                and zlib.crc32(view[body : body + length]) == checksum
+            ):
+                yield HelloCapture._decode(view[body : body + length])
+                offset = body + length
+                continue
+            # Cut short by a crash or while being written
+            offset = data.find(HelloCapture.SYNC, offset + 1)
+            if offset < 0:
+                return
+
+    @staticmethod
+    def offsets(path: str, records: int = 1024) -> List[Tuple[int, int]]:
+        """
+        Splits a capture file into (start, end) offset ranges of up to records targets,
+        reading only the record headers. The ranges cover the whole file, so that read
+        finds the records following a torn one.
+        """
+        HelloCapture._check_magic(path)
+        size = os.path.getsize(path)
+        ranges = []
+        with open(path, "rb") as capture:
+            offset = start = len(HelloCapture.MAGIC)
+            count = 0
+            while offset + HelloCapture.RECORD.size <= size:
+                capture.seek(offset)
+                sync, length, _ = HelloCapture.RECORD.unpack(
+                    capture.read(HelloCapture.RECORD.size)
+                )
+                end = offset + HelloCapture.RECORD.size + length
+                # Ranges only end where the next record starts
+                if end < size:
+                    capture.seek(end)
+                    intact = capture.read(len(HelloCapture.SYNC)) == HelloCapture.SYNC
+                else:
+                    intact = end == size
+                if sync != HelloCapture.SYNC or not intact:
+                    # A torn record, which read skips
+                    offset = HelloCapture._find_sync(capture, offset + 1)
+                    if offset < 0:
+                        break
+                    continue
+                offset = end
+                count += 1
+                if count == records:
+                    ranges.append((start, offset))
+                    start = offset
+                    count = 0
+            if start < size:
+                ranges.append((start, size))
+        return ranges
+
+    @staticmethod
+    def reparse(
+        path: str, processes: Optional[int] = None, records: int = 1024
+    ) -> Iterator[Tuple[str, str, int, float]]:
+        """
+        Computes the JARM hash of every target of a capture file again, spread over
+        several processes.
+
+        Args:
+            path (str):
+                The capture file.
+            processes (int, optional):
+                The number of worker processes. Defaults to the number of CPUs, 1 parses
+                in this process.
+            records (int, optional, default=1024):
+                How many targets are handed to a worker at a time.
+        Returns:
+            :iterator:
+                Yields a (jarm, host, port, capture time) tuple per target, in file order.
+        Examples:
+            >>> for jarm, host, port, _ in HelloCapture.reparse("scan.cap"):
+            ...     print(jarm, host, port)
+
+        """
+        ranges = HelloCapture.offsets(path, records)
+        processes = processes or os.cpu_count() or 1
+        if processes == 1 or len(ranges) <= 1:
+            for byte_range in ranges:
+                yield from HelloCapture._reparse_range(path, byte_range)
+            return
+        with multiprocessing.get_context().Pool(processes) as pool:
+            for results in pool.imap(
+                HelloCapture._reparse_range_list, [(path, r) for r in ranges]
+            ):
+                yield from results
+
+    @staticmethod
+    def _reparse_range(
+        path: str, byte_range: Tuple[int, int]
+    ) -> List[Tuple[str, str, int, float]]:
+        # Imported here, the scanner imports this module
+        from jarm.scanner.scanner import Scanner
+
+        targets = list(HelloCapture.read(path, *byte_range))
+        raw = [
+            ",".join(Scanner._read_server_hello(r) for r in target[4])
+            for target in targets
+        ]
+        return [
+            (jarm, target[0], target[1], target[3])
+            for jarm, target in zip(Hasher.jarm_batch(raw), targets)
+        ]
+
+    @staticmethod
+    def _reparse_range_list(
+        args: Tuple[str, Tuple[int, int]],
+    ) -> List[Tuple[str, str, int, float]]:
+        return HelloCapture._reparse_range(*args)
+
+    @staticmethod
+    def _decode(record: memoryview) -> CapturedTarget:
+        captured, port, host_length, ip_length, count = HelloCapture.HEADER.unpack_from(
+            record
+        )
+        offset = HelloCapture.HEADER.size
+        host = bytes(record[offset : offset + host_length]).decode()
+        offset += host_length
+        ip = bytes(record[offset : offset + ip_length]).decode() or None
+        offset += ip_length
+        responses = []
+        for _ in range(count):
+            (length,) = HelloCapture.RESPONSE.unpack_from(record, offset)
+            offset += HelloCapture.RESPONSE.size
+            responses.append(bytes(record[offset : offset + length]))
+            offset += length
+        return host, port, ip, captured, responses
+
+    @staticmethod
+    def _find_sync(capture: BinaryIO, offset: int, block: int = 1 << 16) -> int:
+        """
+        Returns the offset of the next sync marker from offset on, or -1.
+        """
+        capture.seek(offset)
+        # Keep the end of the previous block, a marker may straddle two blocks
+        tail = b""
+        while True:
+            data = capture.read(block)
+            if not data:
+                return -1
+            found = (tail + data).find(HelloCapture.SYNC)
+            if found >= 0:
+                return offset - len(tail) + found
+            tail = data[-(len(HelloCapture.SYNC) - 1) :]
+            offset += len(data)
+
+    @staticmethod
+    def _check_magic(path: str):
+        with open(path, "rb") as capture:
+            if capture.read(len(HelloCapture.MAGIC)) != HelloCapture.MAGIC:
+                raise PyJARMInvalidCapture(f"Not a ServerHello capture: {path}")
@@ -1,13 +1,29 @@
 import asyncio
+from contextlib import suppress
+import errno
+import logging
 import socket
-from typing import Tuple, Dict, Any
+from struct import pack
+import time
+from typing import Tuple, Dict, Any, Optional
 from enum import IntEnum
-import ssl
 
-from jarm.constants import DEFAULT_TIMEOUT
-from jarm.proxy.proxy import Proxy
-from jarm.exceptions.exceptions import PyJARMInvalidProxy
-from jarm.validate.validate import Validate
+from jarm.constants import (
+    DEFAULT_TIMEOUT,
+    MAX_SERVER_HELLO_LENGTH,
+    TLS_HANDSHAKE_RECORD,
+    TLS_RECORD_HEADER_LENGTH,
+)
+from jarm.proxy.proxy import Proxy, ProxyConfig
+from jarm.proxy.socks5 import Socks5
+from jarm.exceptions.exceptions import (
+    PyJARMInvalidProxy,
+    PyJARMInvalidTarget,
+    PyJARMProxyError,
+    PyJARMProxyTargetError,
+)
+from jarm.metrics.metrics import ProbeRecord, SocketMetrics
+from jarm.resolver.resolver import Resolver
 
 
 class Connection:
@@ -16,10 +32,15 @@ class Connection:
         AF_INET = 2
         AF_INET6 = 10
 
+    # Sockets opened by every probe in this process
+    socket_metrics = SocketMetrics()
+
     @staticmethod
     async def prep_connection(
         connect_target: Dict[str, Any],
+        record: Optional[ProbeRecord] = None,
     ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        start = time.monotonic()
         reader, writer = await asyncio.open_connection(
             host=connect_target.get("connect_host"),
             port=connect_target.get("connect_port"),
@@ -28,32 +49,209 @@ class Connection:
             ssl=connect_target.get("ssl"),
             server_hostname=connect_target.get("server_hostname"),
         )
+        Connection.socket_metrics.socket_opened()
+        connected = time.monotonic()
+        if record is not None:
+            record.connect = connected - start
         if connect_target.get("use_proxy"):
             target = f'{connect_target.get("target_host")}:{connect_target.get("target_port")}'
-            await Proxy.handle_proxy(
-                reader,
-                writer,
-                target,
-                connect_target.get("proxy_auth"),
-                connect_target.get("proxy_username"),
-                connect_target.get("proxy_password"),
-            )
+            proxy = connect_target.get("proxy")
+            try:
+                if proxy is not None and proxy.socks:
+                    await Socks5.handshake(
+                        reader,
+                        writer,
+                        connect_target.get("target_ip")
+                        or connect_target["target_host"],
+                        connect_target["target_port"],
+                        proxy.username,
+                        proxy.password,
+                    )
+                else:
+                    await Proxy.handle_proxy(
+                        reader,
+                        writer,
+                        target,
+                        connect_target.get("proxy_auth"),
+                    )
+            except BaseException:
+                Connection.drop_connection(
+                    writer, connect_target.get("fast_teardown", False)
+                )
+                raise
+            if record is not None:
+                record.proxy = time.monotonic() - connected
         return reader, writer
 
     @staticmethod
-    async def jarm_data(conn_target: Dict[str, Any], data: bytes) -> bytes:
-        reader, writer = await Connection.prep_connection(conn_target)
-        writer.write(data)
-        await writer.drain()
-        out = await reader.read(1484)
-        writer.close()
-        await writer.wait_closed()
+    def drop_connection(writer: asyncio.StreamWriter, fast_teardown: bool = False):
+        """
+        Closes a connection without waiting for the close to complete.
+
+        With fast_teardown the socket is reset (SO_LINGER 0) instead of closed gracefully,
+        so it does not linger in FIN_WAIT or TIME_WAIT.
+        """
+        if fast_teardown:
+            sock = writer.get_extra_info("socket")
+            if sock is not None:
+                with suppress(OSError):
+                    sock.setsockopt(
+                        socket.SOL_SOCKET, socket.SO_LINGER, pack("ii", 1, 0)
+                    )
+            writer.transport.abort()
+        else:
+            writer.close()
+        Connection.socket_metrics.socket_closed(aborted=bool(fast_teardown))
+
+    @staticmethod
+    async def read_server_hello(
+        reader: asyncio.StreamReader,
+        limit: int = MAX_SERVER_HELLO_LENGTH,
+        record: Optional[ProbeRecord] = None,
+    ) -> bytes:
+        """
+        Reads the first TLS record sent by the server, up to limit bytes.
+
+        The record header is read first and then exactly the length it announces, so a
+        ServerHello split across several segments is returned whole. Reading stops right
+        after the header for alerts or anything else that is not a handshake record.
+        """
+        start = time.monotonic()
+        try:
+            header = await reader.readexactly(TLS_RECORD_HEADER_LENGTH)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        if record is not None:
+            record.first_byte = time.monotonic() - start
+        if header[0] != TLS_HANDSHAKE_RECORD:
+            return header
+        length = min(
+            int.from_bytes(header[3:5], byteorder="big"),
+            limit - TLS_RECORD_HEADER_LENGTH,
+        )
+        try:
+            return header + await reader.readexactly(length)
+        except asyncio.IncompleteReadError as e:
+            return header + e.partial
+
+    @staticmethod
+    async def jarm_data(
+        conn_target: Dict[str, Any],
+        data: bytes,
+        record: Optional[ProbeRecord] = None,
+    ) -> bytes:
+        reader, writer = await Connection.prep_connection(conn_target, record)
+        fast_teardown = conn_target.get("fast_teardown", False)
+        try:
+            writer.write(data)
+            await writer.drain()
+            out = await Connection.read_server_hello(reader, record=record)
+        except BaseException:
+            # Includes the cancellation when the probe times out
+            Connection.drop_connection(writer, fast_teardown)
+            raise
+        if fast_teardown:
+            Connection.drop_connection(writer, fast_teardown)
+        else:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            finally:
+                Connection.socket_metrics.socket_closed()
         return out
 
     @staticmethod
     async def jarm_connect(
-        target: Tuple[str, int], connect_args: Dict[str, Any], data: bytes, check: str
+        target: Tuple[str, int],
+        connect_args: Dict[str, Any],
+        data: bytes,
+        check: str,
+        record: Optional[ProbeRecord] = None,
     ) -> Any:
+        """
+        Sends one JARM probe and returns a (check, response) tuple. The response is empty
+        if the probe timed out.
+
+        If a ProbeRecord is given, it is filled in with the timings and outcome of the
+        probe, see ProbeRecord.
+        """
+        start = time.monotonic()
+        conn_target = Connection._connect_target(target, connect_args)
+        try:
+            await Connection._resolve_connect_target(conn_target, connect_args)
+            if record is not None:
+                record.resolve = time.monotonic() - start
+                record.ip = conn_target["connect_host"]
+            fut = Connection.jarm_data(conn_target, data, record)
+            output = b""
+            try:
+                output = await asyncio.wait_for(fut, timeout=conn_target["timeout"])
+            except asyncio.TimeoutError as e:
+                if record is not None:
+                    record.outcome = ProbeRecord.TIMEOUT
+            else:
+                if record is not None:
+                    record.outcome = Connection.response_outcome(output)
+        except Exception as e:
+            if record is not None:
+                record.outcome = Connection.error_outcome(e)
+                record.error = repr(e)
+            raise
+        finally:
+            if record is not None:
+                record.total = time.monotonic() - start
+        return (check, output)
+
+    @staticmethod
+    async def check_port(
+        target: Tuple[str, int],
+        connect_args: Dict[str, Any],
+        quiet: bool = False,
+    ) -> bool:
+        """
+        Checks that the target accepts TCP connections, through the proxy if one is set,
+        without sending a probe. The connection is reset as soon as it is established.
+
+        Args:
+            target (tuple):
+                The (host, port) to check.
+            connect_args (dict):
+                The same connection arguments as for jarm_connect.
+            quiet (bool, optional, default=False):
+                Does not log unexpected errors, such as a malformed target.
+        Returns:
+            :bool:
+                True if the connection was established within the timeout. Any error
+                counts as a closed port.
+        """
+
+        async def connect():
+            conn_target = Connection._connect_target(target, connect_args)
+            await Connection._resolve_connect_target(conn_target, connect_args)
+            _, writer = await Connection.prep_connection(conn_target)
+            Connection.drop_connection(writer, True)
+
+        timeout = connect_args.get("timeout")
+        if not timeout or not isinstance(timeout, (int, float)):
+            timeout = DEFAULT_TIMEOUT
+        try:
+            await asyncio.wait_for(connect(), timeout=timeout)
+        except (OSError, asyncio.TimeoutError, PyJARMInvalidTarget, PyJARMProxyError):
+            return False
+        except Exception:
+            if not quiet:
+                logging.exception(f"Unknown Exception checking {target}")
+            return False
+        return True
+
+    @staticmethod
+    def _connect_target(
+        target: Tuple[str, int], connect_args: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Validates the connection arguments and builds the connection target for a
+        target, connect_host is the target or proxy host until it is resolved.
+        """
         address_family = connect_args.get("address_family")
 
         if not address_family:
@@ -62,22 +260,18 @@ class Connection:
             raise ValueError("AddressFamily not supported")
 
         timeout = connect_args.get("timeout")
-        if not timeout or not isinstance(timeout, int):
+        if not timeout or not isinstance(timeout, (int, float)):
             timeout = DEFAULT_TIMEOUT
 
-        proxy_string = connect_args.get("proxy")
-        if proxy_string and not isinstance(proxy_string, str):
-            raise ValueError("Proxy string must be str")
-
-        proxy_auth = connect_args.get("proxy_auth")
-        if proxy_auth and not isinstance(proxy_auth, str):
-            raise ValueError("proxy auth must be str")
-
         verify = connect_args.get("verify", True)
         if not isinstance(verify, bool):
             raise ValueError("verify must be boolean")
 
-        proxy = Proxy.parse_proxy(proxy_string)
+        fast_teardown = connect_args.get("fast_teardown", False)
+        if not isinstance(fast_teardown, bool):
+            raise ValueError("fast_teardown must be boolean")
+
+        proxy = Connection.proxy_config(connect_args)
 
         conn_target: Dict[str, Any] = {
             "target_host": target[0],
@@ -85,43 +279,116 @@ class Connection:
             "address_family": address_family,
             "timeout": timeout,
             "verify": verify,
+            "fast_teardown": fast_teardown,
         }
 
-        if proxy:
-            if not proxy.hostname:
-                raise PyJARMInvalidProxy("Invalid or missing proxy hostname")
-            connection_host = proxy.hostname
-            conn_target["proxy_auth"] = proxy_auth
+        if proxy.url is not None:
+            connection_host = proxy.host
+            connection_port = proxy.port
+            conn_target["proxy"] = proxy
+            conn_target["proxy_auth"] = proxy.auth_header
             conn_target["use_proxy"] = True
-            conn_target["proxy_username"] = proxy.username if proxy.username else None
-            conn_target["proxy_password"] = proxy.password if proxy.password else None
-
-            if proxy.scheme == "https":
-                ctx = ssl.create_default_context()
-                if verify is False:
-                    ctx.verify_mode = ssl.CERT_NONE
-                connection_port = proxy.port if proxy.port else 8443
-                conn_target["ssl"] = ctx
+            if proxy.ssl is not None:
+                conn_target["ssl"] = proxy.ssl
                 conn_target["server_hostname"] = connection_host
-            elif proxy.scheme == "http":
-                connection_port = proxy.port if proxy.port else 8080
-            else:
-                raise PyJARMInvalidProxy("Invalid proxy connection scheme")
         else:
             connection_host = target[0]
             connection_port = target[1]
 
-        # Validate and resolve the connection target (either real target or proxy)
-        target_family, _, _, _, target_addr = Validate.validate_target(
-            connection_host, connection_port, address_family
+        conn_target["connect_host"] = connection_host
+        conn_target["connect_port"] = connection_port
+        return conn_target
+
+    @staticmethod
+    def proxy_config(connect_args: Dict[str, Any]) -> ProxyConfig:
+        """
+        Returns the ProxyConfig of the connection arguments, set up once by the Scanner,
+        or builds one from the proxy, proxy_auth and verify arguments.
+        """
+        config = connect_args.get("proxy_config")
+        if config is not None:
+            return config
+        proxy_string = connect_args.get("proxy")
+        if proxy_string and not isinstance(proxy_string, str):
+            raise ValueError("Proxy string must be str")
+
+        proxy_auth = connect_args.get("proxy_auth")
+        if proxy_auth and not isinstance(proxy_auth, str):
+            raise ValueError("proxy auth must be str")
+
+        return ProxyConfig(
+            proxy_string, auth=proxy_auth, verify=connect_args.get("verify", True)
         )
+
+    @staticmethod
+    async def _resolve_connect_target(
+        conn_target: Dict[str, Any], connect_args: Dict[str, Any]
+    ):
+        """
+        Resolves the connection target (either real target or proxy) in place.
+        """
+        connection_port = conn_target["connect_port"]
+        address_family = conn_target["address_family"]
+        dest_ip = connect_args.get("dest_ip")
+        resolver = connect_args.get("resolver")
+        if conn_target.get("use_proxy"):
+            proxy = conn_target["proxy"]
+            if proxy.local_dns:
+                # The proxy is sent the address of the target rather than its name
+                if dest_ip:
+                    conn_target["target_ip"] = dest_ip
+                else:
+                    info = await (resolver or Resolver.default()).resolve(
+                        conn_target["target_host"],
+                        conn_target["target_port"],
+                        address_family,
+                    )
+                    conn_target["target_ip"] = info[4][0]
+            target_info = await proxy.resolve(address_family, resolver)
+        elif dest_ip:
+            target_info = Resolver.numeric(dest_ip, connection_port, address_family)
+        else:
+            target_info = await (resolver or Resolver.default()).resolve(
+                conn_target["connect_host"], connection_port, address_family
+            )
+        target_family, _, _, _, target_addr = target_info
         conn_target["connect_host"] = target_addr[0]
-        conn_target["connect_port"] = connection_port
         conn_target["address_family"] = target_family
-        fut = Connection.jarm_data(conn_target, data)
-        output = b""
-        try:
-            output = await asyncio.wait_for(fut, timeout=timeout)
-        except asyncio.TimeoutError as e:
-            pass
-        return (check, output)
+
+    @staticmethod
+    def response_outcome(response: bytes) -> str:
+        """
+        Classifies the response to a probe that did not time out.
+        """
+        if not response:
+            return ProbeRecord.CLOSED
+        if response[0] == 21:
+            return ProbeRecord.ALERT
+        return ProbeRecord.OK
+
+    @staticmethod
+    def error_outcome(e: BaseException) -> str:
+        """
+        Classifies the exception that ended a probe.
+        """
+        if isinstance(e, ConnectionRefusedError):
+            return ProbeRecord.REFUSED
+        if isinstance(
+            e, (ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+        ):
+            return ProbeRecord.RESET
+        if isinstance(e, asyncio.TimeoutError):
+            return ProbeRecord.TIMEOUT
+        if isinstance(e, PyJARMInvalidTarget):
+            return ProbeRecord.DNS
+        if isinstance(e, PyJARMProxyTargetError):
+            return e.outcome
+        if isinstance(e, (PyJARMProxyError, PyJARMInvalidProxy)):
+            return ProbeRecord.PROXY
+        if isinstance(e, OSError) and e.errno in (
+            errno.EHOSTUNREACH,
+            errno.ENETUNREACH,
+            errno.EHOSTDOWN,
+        ):
+            return ProbeRecord.UNREACHABLE
+        return ProbeRecord.ERROR
@@ -65,3 +65,7 @@ ERROR_INC_2: bytes = b"\x0f\xf0\x0b"
 
 # CONNECTION
 DEFAULT_TIMEOUT = 20
+TLS_RECORD_HEADER_LENGTH: int = 5
+TLS_HANDSHAKE_RECORD: int = 22
+# Never read more than this from a server, the ServerHello is at the start of the response
+MAX_SERVER_HELLO_LENGTH: int = 1484
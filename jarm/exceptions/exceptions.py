@@ -20,3 +20,25 @@ class PyJARMInvalidProxy(PyJARMException):
 
 class PyJARMProxyError(PyJARMException):
     pass
+
+
+class PyJARMProxyTargetError(PyJARMProxyError):
+    """
+    The proxy is working but could not connect to the target. outcome is the
+    ProbeRecord outcome of the failure, such as refused or unreachable.
+    """
+
+    def __init__(self, message: str, outcome: str):
+        super().__init__(message)
+        self.outcome = outcome
+
+    def __reduce__(self):
+        return (type(self), (str(self), self.outcome))
+
+
+class PyJARMTargetUnreachable(PyJARMException):
+    pass
+
+
+class PyJARMInvalidCapture(PyJARMException):
+    pass
@@ -1,6 +1,6 @@
 import hashlib
 import logging
-from typing import List
+from typing import Dict, Iterable, List
 
 from jarm.constants import TOTAL_FAILURE
 
@@ -79,43 +79,67 @@ class Hasher:
         b"\x13\x05",
     ]
 
+    # Maps the hex of each cipher to its two character position in CIPHER_LIST
+    CIPHER_INDEX: Dict[str, str] = {
+        bytes_.hex(): f"{count:02x}" for count, bytes_ in enumerate(CIPHER_LIST, 1)
+    }
+    # Ciphers not in CIPHER_LIST get the position after the last entry
+    UNKNOWN_CIPHER: str = f"{len(CIPHER_LIST) + 1:02x}"
+
     @staticmethod
     def jarm(scan_result: str):
         """"""
         logging.debug(f"Raw JARM: {scan_result}")
+        return Hasher._hash(scan_result)
+
+    @staticmethod
+    def jarm_batch(scan_results: Iterable[str]) -> List[str]:
+        """
+        Hashes many raw JARM results in one call.
+
+        Identical raw results are only hashed once, which makes rehashing large sets of
+        stored results, where most servers share a handful of fingerprints, much cheaper.
+
+        Args:
+            scan_results (iterable<str>):
+                Raw JARM results, as passed to jarm.
+        Returns:
+            :list<str>:
+                The JARM hash of each raw result, in the same order.
+        """
+        hashed: Dict[str, str] = {}
+        output: List[str] = []
+        for scan_result in scan_results:
+            jarm = hashed.get(scan_result)
+            if jarm is None:
+                jarm = Hasher._hash(scan_result)
+                hashed[scan_result] = jarm
+            output.append(jarm)
+        return output
+
+    @staticmethod
+    def _hash(scan_result: str) -> str:
         if scan_result == TOTAL_FAILURE:
             return "0" * 62
-        fuzzy_hash = ""
-        alpns_and_ext = ""
+        fuzzy_hash: List[str] = []
+        alpns_and_ext: List[str] = []
         for handshake in scan_result.split(","):
             components = handshake.split("|")
             # Custom jarm hash includes a fuzzy hash of the ciphers and versions
-            fuzzy_hash += Hasher._cipher_bytes(components[0])
-            fuzzy_hash += Hasher._version_byte(components[1])
-            alpns_and_ext += components[2]
-            alpns_and_ext += components[3]
+            fuzzy_hash.append(Hasher._cipher_bytes(components[0]))
+            fuzzy_hash.append(Hasher._version_byte(components[1]))
+            alpns_and_ext.append(components[2])
+            alpns_and_ext.append(components[3])
         # Custom jarm hash has the sha256 of alpns and extensions added to the end
-        sha256 = (hashlib.sha256(alpns_and_ext.encode())).hexdigest()
-        fuzzy_hash += sha256[0:32]
-        return fuzzy_hash
+        sha256 = (hashlib.sha256("".join(alpns_and_ext).encode())).hexdigest()
+        fuzzy_hash.append(sha256[0:32])
+        return "".join(fuzzy_hash)
 
     @staticmethod
     def _cipher_bytes(cipher: str):
         if cipher == "":
             return "00"
-        count = 1
-        for bytes_ in Hasher.CIPHER_LIST:
-            strtype_bytes = str(bytes_.hex())
-            if cipher == strtype_bytes:
-                break
-            count += 1
-        hexvalue = str(hex(count))[2:]
-        # This part must always be two bytes
-        if len(hexvalue) < 2:
-            return_bytes = "0" + hexvalue
-        else:
-            return_bytes = hexvalue
-        return return_bytes
+        return Hasher.CIPHER_INDEX.get(cipher, Hasher.UNKNOWN_CIPHER)
 
     @staticmethod
     def _version_byte(version: str):
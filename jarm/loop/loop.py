@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from typing import Any, Callable, Coroutine, Optional
+
+
+class EventLoop:
+    """
+    Runs coroutines on the default asyncio event loop or, when asked for and installed,
+    on uvloop, which has a much lower per callback overhead with many open sockets.
+    """
+
+    @staticmethod
+    def fast_loop_factory() -> Optional[Callable[[], asyncio.AbstractEventLoop]]:
+        """
+        Returns the function creating uvloop event loops, or None if uvloop is not
+        installed.
+        """
+        try:
+            import uvloop  # type: ignore
+        except ImportError:
+            return None
+        return uvloop.new_event_loop
+
+    @staticmethod
+    def run(main: Coroutine[Any, Any, Any], fast: bool = False) -> Any:
+        """
+        Runs a coroutine to completion in a new event loop, like asyncio.run.
+
+        Args:
+            main (coroutine):
+                The coroutine to run.
+            fast (bool, optional, default=False):
+                Uses uvloop if it is installed (pip install pyjarm[fast]), the default
+                event loop otherwise.
+        Returns:
+            The result of the coroutine.
+        """
+        factory = EventLoop.fast_loop_factory() if fast else None
+        if factory is None:
+            if fast:
+                logging.warning("uvloop is not installed, using the default event loop")
+            return asyncio.run(main)
+        if hasattr(asyncio, "Runner"):
+            with asyncio.Runner(loop_factory=factory) as runner:
+                return runner.run(main)
+        loop = factory()
+        try:
+            asyncio.set_event_loop(loop)
+            return loop.run_until_complete(main)
+        finally:
+            try:
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            finally:
+                asyncio.set_event_loop(None)
+                loop.close()
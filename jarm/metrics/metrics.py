@@ -0,0 +1,227 @@
+from bisect import bisect_left
+from typing import Any, Dict, Optional, Tuple
+
+
+class SocketMetrics:
+    """
+    Counts the probe sockets opened by this process.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.open = 0
+        self.peak = 0
+        self.opened = 0
+        self.closed = 0
+        self.aborted = 0
+
+    def socket_opened(self):
+        self.opened += 1
+        self.open += 1
+        if self.open > self.peak:
+            self.peak = self.open
+
+    def socket_closed(self, aborted: bool = False):
+        self.closed += 1
+        self.open -= 1
+        if aborted:
+            self.aborted += 1
+
+    def merge(self, other: "SocketMetrics"):
+        """
+        Adds the sockets counted by another process. Processes run side by side, so
+        their peaks add up.
+        """
+        self.open += other.open
+        self.peak += other.peak
+        self.opened += other.opened
+        self.closed += other.closed
+        self.aborted += other.aborted
+
+    def __str__(self):
+        return (
+            f"Sockets: {self.open} open, {self.peak} peak, {self.opened} opened, "
+            f"{self.closed} closed ({self.aborted} aborted)"
+        )
+
+
+class ProbeRecord:
+    """
+    Timings and outcome of a single JARM probe.
+
+    Timings are in seconds and stay None for phases the probe never reached. resolve is
+    the time spent resolving the target or proxy, the target being resolved once and
+    counted on the first probe to finish, connect the TCP (and proxy TLS)
+    connection, proxy the proxy CONNECT exchange, first_byte the time from sending the
+    ClientHello to receiving the start of the response and total the whole probe.
+    Timings and outcome are those of the last attempt, retries counts the earlier ones.
+    """
+
+    __slots__ = (
+        "host",
+        "port",
+        "ip",
+        "probe",
+        "outcome",
+        "error",
+        "resolve",
+        "connect",
+        "proxy",
+        "first_byte",
+        "total",
+        "retries",
+    )
+
+    # Outcomes
+    OK = "ok"
+    TIMEOUT = "timeout"
+    REFUSED = "refused"
+    RESET = "reset"
+    UNREACHABLE = "unreachable"
+    CLOSED = "closed"
+    ALERT = "alert"
+    INVALID = "invalid"
+    DNS = "dns"
+    PROXY = "proxy"
+    ERROR = "error"
+
+    TIMINGS = ("resolve", "connect", "proxy", "first_byte", "total")
+
+    def __init__(self, host: str, port: int, probe: str):
+        self.host = host
+        self.port = port
+        self.probe = probe
+        self.ip: Optional[str] = None
+        self.outcome: Optional[str] = None
+        self.error: Optional[str] = None
+        self.resolve: Optional[float] = None
+        self.connect: Optional[float] = None
+        self.proxy: Optional[float] = None
+        self.first_byte: Optional[float] = None
+        self.total: Optional[float] = None
+        self.retries = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"ProbeRecord({self.as_dict()!r})"
+
+
+class Histogram:
+    """
+    A fixed bucket histogram of durations.
+    """
+
+    # Upper bounds of the buckets, in seconds
+    BOUNDS: Tuple[float, ...] = (
+        0.001,
+        0.002,
+        0.005,
+        0.01,
+        0.02,
+        0.05,
+        0.1,
+        0.2,
+        0.5,
+        1,
+        2,
+        5,
+        10,
+        20,
+        60,
+        float("inf"),
+    )
+
+    def __init__(self):
+        self.counts = [0] * len(Histogram.BOUNDS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.counts[bisect_left(Histogram.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram"):
+        """
+        Adds the values counted by another histogram.
+        """
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        if other.max > self.max:
+            self.max = other.max
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns the upper bound of the bucket holding the q quantile, or the largest
+        value seen if that is smaller.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(Histogram.BOUNDS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class ProbeStats:
+    """
+    Aggregates ProbeRecords into per phase histograms and outcome counts.
+
+    An instance can be passed directly as the on_probe hook of the Scanner.
+    """
+
+    def __init__(self) -> None:
+        self.outcomes: Dict[str, int] = {}
+        self.retries = 0
+        self.histograms: Dict[str, Histogram] = {
+            name: Histogram() for name in ProbeRecord.TIMINGS
+        }
+
+    def __call__(self, record: ProbeRecord):
+        self.add(record)
+
+    def add(self, record: ProbeRecord):
+        outcome = record.outcome or ProbeRecord.ERROR
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.retries += record.retries
+        for name, histogram in self.histograms.items():
+            value = getattr(record, name)
+            if value is not None:
+                histogram.add(value)
+
+    def merge(self, other: "ProbeStats"):
+        """
+        Adds the probes aggregated by another instance, such as one from a worker process.
+        """
+        for outcome, count in other.outcomes.items():
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + count
+        self.retries += other.retries
+        for name, histogram in self.histograms.items():
+            histogram.merge(other.histograms[name])
+
+    def __str__(self):
+        lines = [
+            f"Probes: {sum(self.outcomes.values())} ("
+            + ", ".join(f"{k}: {v}" for k, v in sorted(self.outcomes.items()))
+            + f"), {self.retries} retries",
+            f"{'phase':<12}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}",
+        ]
+        for name, h in self.histograms.items():
+            mean = h.sum / h.count if h.count else 0.0
+            values = [mean, h.quantile(0.5), h.quantile(0.9), h.quantile(0.99), h.max]
+            lines.append(
+                f"{name:<12}{h.count:>8}"
+                + "".join(f"{v * 1000:>8.1f}ms" for v in values)
+            )
+        return "\n".join(lines)
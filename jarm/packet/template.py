@@ -0,0 +1,167 @@
+import os
+import random
+from struct import pack, pack_into
+from typing import Any, Dict
+
+from jarm.constants import GREASE, TLS_1_3, SUPPORT_1_2
+from jarm.ciphers.ciphers import CIPHERS, CipherSet
+from jarm.exceptions.exceptions import PyJARMUnexpectedException
+from jarm.grease.grease import GREASE_VALUES
+from jarm.packet.packet import Packet
+from jarm.versions.versions import TLS_VERSIONS, TLSVersion
+
+
+class PacketTemplate:
+    """
+    A precompiled ClientHello for a single JARM hello format.
+
+    The cipher suites, ALPN list and extension layout of a format never change, so the
+    packet is assembled once and only the SNI, the length fields and the random values
+    (client random, session id, key share and GREASE) are filled in for each target.
+    The output is byte for byte identical to Packet.build.
+    """
+
+    _cache: Dict[type, "PacketTemplate"] = {}
+
+    def __init__(self, jarm_hello_format: Any):
+        fmt = jarm_hello_format
+        self.grease = fmt.grease == GREASE
+        # Reuse the Packet helpers that do not involve random values
+        packet = Packet(dest_host="", dest_port=0, jarm_hello_format=fmt)
+
+        version = TLS_VERSIONS.get(fmt.version)
+        if version is None or not isinstance(version, TLSVersion):
+            raise PyJARMUnexpectedException()
+        cipher_set = CIPHERS.get(fmt.cipher_choice)
+        if cipher_set is None or not isinstance(cipher_set, CipherSet):
+            raise PyJARMUnexpectedException(
+                "Could not find expected output for cipher choice"
+            )
+        ciphers = b"".join(
+            packet._reorder(pre_list=list(cipher_set.values), order=fmt.cipher_order)
+        )
+
+        # Everything up to the SNI extension
+        head = bytearray(Packet.PAYLOAD_BASE)
+        head += version.payload
+        head += Packet.DOUBLE_PAD  # record length
+        head += Packet.HANDSHAKE_PROTOCOL_PAD
+        head += Packet.SINGLE_PAD
+        head += Packet.DOUBLE_PAD  # handshake length
+        head += version.hello
+        self.random_offset = len(head)
+        head += bytes(32)
+        head += pack(">B", 32)
+        self.session_id_offset = len(head)
+        head += bytes(32)
+        head += pack(">H", len(ciphers) + (2 if self.grease else 0))
+        self.cipher_grease_offset = len(head)
+        if self.grease:
+            head += Packet.DOUBLE_PAD
+        head += ciphers
+        head += b"\x01"  # cipher methods
+        head += b"\x00"  # compression_methods
+        self.extensions_length_offset = len(head)
+        head += Packet.DOUBLE_PAD
+        self.extension_grease_offset = len(head)
+        if self.grease:
+            head += Packet.DOUBLE_PAD
+            head += Packet.DOUBLE_PAD
+
+        # Everything after the SNI extension, offsets are relative to the tail
+        tail = bytearray(Packet.EXTENSION_MASTER_SECRET)
+        tail += Packet.MAX_FRAG_LENGTH
+        tail += Packet.RENEGOTIATION_INFO
+        tail += Packet.SUPPORTED_GROUPS
+        tail += Packet.EC_POINT_FORMATS
+        tail += Packet.SESSION_TICKET
+        tail += packet._app_layer_proto_negotiation(
+            alpn=fmt.alpn, extension_order=fmt.extension_order
+        )
+        tail += Packet.SIGNATURE_ALGORITHMS
+
+        share_length = 36 + (len(Packet.KEY_SHARE_GREASE_PAD) + 2 if self.grease else 0)
+        tail += Packet.KEY_SHARE_BASE
+        tail += pack(">H", share_length + 2)
+        tail += pack(">H", share_length)
+        self.key_share_grease_offset = len(tail)
+        if self.grease:
+            tail += Packet.DOUBLE_PAD
+            tail += Packet.KEY_SHARE_GREASE_PAD
+        tail += Packet.KEY_SHARE_GROUP
+        tail += Packet.KEY_SHARE_KEY_EXCHANGE_LENGTH
+        self.key_share_offset = len(tail)
+        tail += bytes(32)
+        tail += Packet.PSK_KEY_EXCHANGE_MODES
+
+        self.supported_versions = fmt.version == TLS_1_3 or fmt.support == SUPPORT_1_2
+        self.versions_grease_offset = len(tail)
+        if self.supported_versions:
+            tls = packet._reorder(
+                pre_list=list(
+                    Packet.SUB_TLS_1_2_SUPPORT
+                    if fmt.support == SUPPORT_1_2
+                    else Packet.TLS_1_3_SUPPORT
+                ),
+                order=fmt.extension_order,
+            )
+            versions_length = 2 * len(tls) + (2 if self.grease else 0)
+            tail += Packet.SUPPORTED_VERSION_BASE
+            tail += pack(">H", versions_length + 1)
+            tail += pack(">B", versions_length)
+            self.versions_grease_offset = len(tail)
+            if self.grease:
+                tail += Packet.DOUBLE_PAD
+            tail += b"".join(tls)
+
+        self.head = bytes(head)
+        self.tail = bytes(tail)
+
+    @staticmethod
+    def for_format(jarm_hello_format_class: type) -> "PacketTemplate":
+        """
+        Returns the cached template for a hello format class, such as the entries of V1.
+        """
+        template = PacketTemplate._cache.get(jarm_hello_format_class)
+        if template is None:
+            template = PacketTemplate(jarm_hello_format_class())
+            PacketTemplate._cache[jarm_hello_format_class] = template
+        return template
+
+    def build(self, dest_host: str) -> bytes:
+        """
+        Builds the ClientHello for dest_host with fresh random values.
+        """
+        host = dest_host.encode()
+        host_length = len(dest_host)
+        sni = pack(">HHHBH", 0, host_length + 5, host_length + 3, 0, host_length)
+        head_length = len(self.head)
+        tail_start = head_length + len(sni) + len(host)
+        buf = bytearray(self.head)
+        buf += sni
+        buf += host
+        buf += self.tail
+
+        # Random values are drawn in the same order as Packet.build
+        buf[self.random_offset : self.random_offset + 32] = os.urandom(32)
+        offset = self.session_id_offset
+        buf[offset : offset + 32] = os.urandom(32)
+        if self.grease:
+            offset = self.cipher_grease_offset
+            buf[offset : offset + 2] = random.choice(GREASE_VALUES)
+            offset = self.extension_grease_offset
+            buf[offset : offset + 2] = random.choice(GREASE_VALUES)
+            offset = tail_start + self.key_share_grease_offset
+            buf[offset : offset + 2] = random.choice(GREASE_VALUES)
+        offset = tail_start + self.key_share_offset
+        buf[offset : offset + 32] = os.urandom(32)
+        if self.grease and self.supported_versions:
+            offset = tail_start + self.versions_grease_offset
+            buf[offset : offset + 2] = random.choice(GREASE_VALUES)
+
+        total = len(buf)
+        pack_into(">H", buf, 3, total - 5)
+        pack_into(">H", buf, 7, total - 9)
+        offset = self.extensions_length_offset
+        pack_into(">H", buf, offset, total - offset - 2)
+        return bytes(buf)
@@ -0,0 +1,65 @@
+from typing import Any, Dict, Optional, Tuple
+
+from jarm.connection.connection import Connection
+
+
+class Precheck:
+    """
+    TCP liveness pass run before targets are fingerprinted.
+
+    Each target gets one plain TCP connect, which is reset as soon as it is established.
+    Only targets that accept the connection are sent the JARM probes. Pre-check
+    connections have their own budget, separate from the probe connections, so the
+    whole target list can be checked at a much higher concurrency than it is scanned.
+    """
+
+    def __init__(self, max_connections: int = 1000, timeout: Optional[float] = None):
+        """
+        Initializes a pre-check stage.
+
+        Args:
+            max_connections (int, optional, default=1000):
+                The maximum number of pre-check connections open at the same time.
+            timeout (float, optional):
+                How long to wait for each connection. Defaults to the scan timeout.
+        """
+        if max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.checked = 0
+        self.alive = 0
+
+    @property
+    def pruned(self) -> int:
+        return self.checked - self.alive
+
+    async def check(
+        self,
+        target: Tuple[str, int],
+        connect_args: Dict[str, Any],
+        quiet: bool = False,
+    ) -> bool:
+        """
+        Returns whether the target accepts TCP connections, see Connection.check_port.
+        """
+        if self.timeout:
+            connect_args = {**connect_args, "timeout": self.timeout}
+        alive = await Connection.check_port(target, connect_args, quiet)
+        self.checked += 1
+        if alive:
+            self.alive += 1
+        return alive
+
+    def merge(self, other: "Precheck"):
+        """
+        Adds the targets counted by another instance, such as one from a worker process.
+        """
+        self.checked += other.checked
+        self.alive += other.alive
+
+    def __str__(self):
+        return (
+            f"Pre-check: {self.checked} checked, {self.alive} open, "
+            f"{self.pruned} pruned"
+        )
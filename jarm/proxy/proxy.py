@@ -1,12 +1,24 @@
+import time
 from urllib.request import getproxies
-from urllib.parse import urlparse
+from urllib.parse import unquote, urlparse
 from base64 import b64encode
-from typing import Dict, Optional
-from jarm.exceptions.exceptions import PyJARMProxyError
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from jarm.exceptions.exceptions import (
+    PyJARMInvalidProxy,
+    PyJARMProxyError,
+    PyJARMProxyTargetError,
+)
+from jarm.metrics.metrics import ProbeRecord
+from jarm.resolver.resolver import Resolver
 import asyncio
+import ssl
 
 
 class Proxy:
+    # CONNECT answers of a proxy that could not reach the target: Bad Gateway, Service
+    # Unavailable (Squid's answer to a refused connection) and Gateway Timeout
+    TARGET_ERRORS = ("502", "503", "504")
+
     @staticmethod
     def get_http_headers() -> Dict[str, str]:
         return {}
@@ -51,12 +63,14 @@ class Proxy:
         if not status:
             raise PyJARMProxyError("No status line received from Proxy")
         response = status.decode().rstrip("\r\n").split(" ")
-        if (
-            not response
-            or len(response) < 2
-            or response[0] != "HTTP/1.1"
-            or response[1] != "200"
-        ):
+        if not response or len(response) < 2 or response[0] != "HTTP/1.1":
+            raise PyJARMProxyError(f"Invalid Proxy Response: {status!r}")
+        if response[1] in Proxy.TARGET_ERRORS:
+            raise PyJARMProxyTargetError(
+                f"Proxy could not connect to {target_str}: {status!r}",
+                ProbeRecord.UNREACHABLE,
+            )
+        if response[1] != "200":
             raise PyJARMProxyError(f"Invalid Proxy Response: {status!r}")
         # Ignore all headers
         while True:
@@ -64,3 +78,254 @@ class Proxy:
             if not line or line == b"\r\n":
                 break
         return
+
+
+class ProxyConfig:
+    """
+    A proxy set up once for a whole scan rather than for every probe.
+
+    Holds the parsed proxy URL, the SSL context of an HTTPS proxy, the prebuilt
+    Proxy-Authorization header and, once known, the resolved proxy address.
+    socks5:// and socks5h:// URLs select a SOCKS5 proxy instead of HTTP CONNECT. Through
+    socks5:// targets are resolved locally and the proxy is sent their IP address, through
+    socks5h:// the proxy resolves them.
+    """
+
+    def __init__(
+        self,
+        proxy: Optional[str] = None,
+        auth: Optional[str] = None,
+        verify: bool = True,
+    ):
+        """
+        Initializes a proxy configuration.
+
+        Args:
+            proxy (str, optional):
+                The proxy URL, see Proxy.parse_proxy. The HTTPS_PROXY environment
+                variable is used if it is not set, 'ignore' disables the proxy.
+            auth (str, optional):
+                The Proxy-Authorization header. Defaults to Basic authentication with
+                the username and password of the proxy URL, if any. SOCKS5 proxies
+                always use the username and password of the URL.
+            verify (bool, optional, default=True):
+                Verifies the certificate of an HTTPS proxy.
+        """
+        self.url = Proxy.parse_proxy(proxy)
+        self.auth = auth
+        self.verify = verify
+        self.host: Optional[str] = None
+        self.port: Optional[int] = None
+        self.ssl: Optional[ssl.SSLContext] = None
+        self.auth_header: Optional[str] = None
+        self.socks = False
+        # Whether targets are resolved here rather than by the proxy
+        self.local_dns = False
+        self.username: Optional[str] = None
+        self.password: Optional[str] = None
+        # address family -> resolved address info
+        self._addresses: Dict[int, Tuple[Any, ...]] = {}
+        if self.url is None:
+            return
+        if not self.url.hostname:
+            raise PyJARMInvalidProxy("Invalid or missing proxy hostname")
+        self.host = self.url.hostname
+        if self.url.scheme == "https":
+            ctx = ssl.create_default_context()
+            if verify is False:
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+            self.ssl = ctx
+            self.port = self.url.port if self.url.port else 8443
+        elif self.url.scheme == "http":
+            self.port = self.url.port if self.url.port else 8080
+        elif self.url.scheme in ("socks5", "socks5h"):
+            self.socks = True
+            self.local_dns = self.url.scheme == "socks5"
+            self.port = self.url.port if self.url.port else 1080
+            if self.url.username is not None:
+                self.username = unquote(self.url.username)
+                self.password = unquote(self.url.password or "")
+            return
+        else:
+            raise PyJARMInvalidProxy("Invalid proxy connection scheme")
+        if auth:
+            self.auth_header = auth
+        elif self.url.username and self.url.password:
+            basic_auth = b64encode(
+                f"{self.url.username}:{self.url.password}".encode()
+            ).decode()
+            self.auth_header = f"Basic {basic_auth}"
+
+    def __reduce__(self):
+        # The SSL context can not be pickled, a copy sets itself up again
+        proxy = self.url.geturl() if self.url is not None else "ignore"
+        return (ProxyConfig, (proxy, self.auth, self.verify))
+
+    def __str__(self):
+        if self.url is None:
+            return "no proxy"
+        return f"{self.url.scheme}://{self.host}:{self.port}"
+
+    async def resolve(
+        self, address_family: int, resolver: Optional[Resolver] = None
+    ) -> Tuple[Any, ...]:
+        """
+        Returns the address info of the proxy, resolving it the first time.
+        """
+        if self.host is None or self.port is None:
+            raise PyJARMInvalidProxy("No proxy is configured")
+        address = self._addresses.get(address_family)
+        if address is None:
+            resolver = resolver or Resolver.default()
+            address = await resolver.resolve(self.host, self.port, address_family)
+            self._addresses[address_family] = address
+        return address
+
+
+class ProxyStats:
+    """
+    Health and load of one proxy of a ProxyPool.
+    """
+
+    def __init__(self) -> None:
+        self.active = 0
+        self.connections = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.latency = 0.0
+        self.latency_count = 0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.latency / self.latency_count if self.latency_count else 0.0
+
+    def merge(self, other: "ProxyStats"):
+        self.connections += other.connections
+        self.failures += other.failures
+        self.ejections += other.ejections
+        self.latency += other.latency
+        self.latency_count += other.latency_count
+
+
+class ProxyPool:
+    """
+    A pool of proxies that targets are spread across.
+
+    Each target is pinned to one proxy for all of its probes, so that its fingerprint
+    is taken through a single egress. A proxy that fails max_failures connections in a
+    row is ejected for ejection_time seconds, then tried again.
+    """
+
+    ROUND_ROBIN = "round_robin"
+    LEAST_LOADED = "least_loaded"
+    STRATEGIES = (ROUND_ROBIN, LEAST_LOADED)
+
+    def __init__(
+        self,
+        proxies: Iterable[str],
+        strategy: str = ROUND_ROBIN,
+        auth: Optional[str] = None,
+        verify: bool = True,
+        max_failures: int = 3,
+        ejection_time: float = 30.0,
+    ):
+        """
+        Initializes a proxy pool.
+
+        Args:
+            proxies (iterable<str>):
+                The proxy URLs, see ProxyConfig.
+            strategy (str, optional, default="round_robin"):
+                How targets are assigned to proxies, either ROUND_ROBIN or LEAST_LOADED,
+                the proxy with the fewest targets in flight.
+            auth (str, optional):
+                The Proxy-Authorization header sent to every proxy, see ProxyConfig.
+            verify (bool, optional, default=True):
+                Verifies the certificates of HTTPS proxies.
+            max_failures (int, optional, default=3):
+                How many connections through a proxy may fail in a row before it is
+                ejected.
+            ejection_time (float, optional, default=30.0):
+                How long, in seconds, an ejected proxy is left out.
+        """
+        if strategy not in ProxyPool.STRATEGIES:
+            raise ValueError(f"strategy must be one of {ProxyPool.STRATEGIES}")
+        self.proxies: List[ProxyConfig] = [
+            ProxyConfig(proxy, auth=auth, verify=verify) for proxy in proxies
+        ]
+        if not self.proxies or any(p.url is None for p in self.proxies):
+            raise PyJARMInvalidProxy("A proxy pool needs at least one proxy URL")
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.ejection_time = ejection_time
+        self.stats = [ProxyStats() for _ in self.proxies]
+        self._next = 0
+
+    def acquire(self) -> ProxyConfig:
+        """
+        Picks the proxy for a new target. Every acquire must be followed by a release.
+        """
+        now = time.monotonic()
+        healthy = [i for i, s in enumerate(self.stats) if s.ejected_until <= now]
+        if not healthy:
+            # Everything is ejected, use the proxy that comes back first
+            healthy = [min(range(len(self.stats)), key=self._ejected_until)]
+        if self.strategy == ProxyPool.ROUND_ROBIN:
+            index = healthy[self._next % len(healthy)]
+            self._next += 1
+        else:
+            index = min(healthy, key=self._load)
+        self.stats[index].active += 1
+        return self.proxies[index]
+
+    def release(self, proxy: ProxyConfig):
+        self.stats[self.proxies.index(proxy)].active -= 1
+
+    def report(self, proxy: ProxyConfig, record: ProbeRecord):
+        """
+        Updates the health of a proxy with the outcome of a probe sent through it.
+        """
+        stats = self.stats[self.proxies.index(proxy)]
+        stats.connections += 1
+        if record.connect is not None and record.proxy is not None:
+            stats.consecutive_failures = 0
+            stats.latency += record.connect + record.proxy
+            stats.latency_count += 1
+        elif record.connect is None or record.outcome == ProbeRecord.PROXY:
+            # The proxy could not be reached or failed the CONNECT request itself. A
+            # proxy that could not connect to the target is not at fault.
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.max_failures:
+                stats.consecutive_failures = 0
+                stats.ejections += 1
+                stats.ejected_until = time.monotonic() + self.ejection_time
+
+    def merge(self, other: "ProxyPool"):
+        """
+        Adds the statistics of another copy of the pool, such as one from a worker
+        process.
+        """
+        for stats, other_stats in zip(self.stats, other.stats):
+            stats.merge(other_stats)
+
+    def _ejected_until(self, index: int) -> float:
+        return self.stats[index].ejected_until
+
+    def _load(self, index: int) -> Tuple[int, float]:
+        return self.stats[index].active, self.stats[index].mean_latency
+
+    def __str__(self):
+        lines = [
+            f"{'proxy':<40}{'connections':>12}{'failures':>10}{'ejections':>10}"
+            f"{'latency':>10}"
+        ]
+        for proxy, s in zip(self.proxies, self.stats):
+            lines.append(
+                f"{str(proxy):<40}{s.connections:>12}{s.failures:>10}"
+                f"{s.ejections:>10}{s.mean_latency * 1000:>8.1f}ms"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,161 @@
+import asyncio
+import ipaddress
+from struct import pack
+from typing import Optional
+
+from jarm.exceptions.exceptions import PyJARMProxyError, PyJARMProxyTargetError
+from jarm.metrics.metrics import ProbeRecord
+
+
+class Socks5:
+    """
+    A minimal asyncio SOCKS5 client (RFC 1928) supporting the CONNECT command, with no
+    authentication or username/password authentication (RFC 1929).
+    """
+
+    VERSION = 5
+    NO_AUTH = 0
+    USERNAME_PASSWORD = 2
+    NO_ACCEPTABLE_METHODS = 0xFF
+    CONNECT = 1
+
+    # Address types
+    IPV4 = 1
+    DOMAIN = 3
+    IPV6 = 4
+
+    REPLIES = {
+        1: "general SOCKS server failure",
+        2: "connection not allowed by ruleset",
+        3: "network unreachable",
+        4: "host unreachable",
+        5: "connection refused",
+        6: "TTL expired",
+        7: "command not supported",
+        8: "address type not supported",
+    }
+    # Replies of a proxy that could not reach the target
+    TARGET_REPLIES = {
+        3: ProbeRecord.UNREACHABLE,
+        4: ProbeRecord.UNREACHABLE,
+        5: ProbeRecord.REFUSED,
+    }
+
+    @staticmethod
+    async def handshake(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        host: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ):
+        """
+        Asks the SOCKS5 server on the other end of the connection to connect to the target.
+
+        The CONNECT request is sent along with the last authentication message rather
+        than after its answer, so the connection is ready after a single round trip, or
+        two with credentials. The target host is sent as a domain name unless it is an
+        IP address, so the proxy resolves it.
+
+        Args:
+            reader (StreamReader):
+                The connection to the proxy.
+            writer (StreamWriter):
+                The connection to the proxy.
+            host (str):
+                The target host.
+            port (int):
+                The target port.
+            username (str, optional):
+                The username for username/password authentication.
+            password (str, optional):
+                The password for username/password authentication.
+        Raises:
+            PyJARMProxyError:
+                The proxy closed the connection, answered with something else than
+                SOCKS5 or refused the request.
+            PyJARMProxyTargetError:
+                The proxy could not connect to the target.
+        """
+        request = Socks5._connect_request(host, port)
+        if username is None:
+            writer.write(bytes((Socks5.VERSION, 1, Socks5.NO_AUTH)) + request)
+            await writer.drain()
+            await Socks5._read_method(reader, Socks5.NO_AUTH)
+        else:
+            writer.write(bytes((Socks5.VERSION, 1, Socks5.USERNAME_PASSWORD)))
+            await writer.drain()
+            await Socks5._read_method(reader, Socks5.USERNAME_PASSWORD)
+            user = username.encode()
+            secret = (password or "").encode()
+            if len(user) > 255 or len(secret) > 255:
+                raise PyJARMProxyError(
+                    "SOCKS5 username and password are limited to 255 bytes"
+                )
+            writer.write(
+                bytes((1, len(user))) + user + bytes((len(secret),)) + secret + request
+            )
+            await writer.drain()
+            status = await Socks5._read(reader, 2)
+            if status[1] != 0:
+                raise PyJARMProxyError("SOCKS5 authentication failed")
+        await Socks5._read_reply(reader)
+
+    @staticmethod
+    def _connect_request(host: str, port: int) -> bytes:
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            name = host.encode("idna")
+            if len(name) > 255:
+                raise PyJARMProxyError(f"Host name too long for SOCKS5: {host}")
+            destination = bytes((Socks5.DOMAIN, len(name))) + name
+        else:
+            kind = Socks5.IPV4 if address.version == 4 else Socks5.IPV6
+            destination = bytes((kind,)) + address.packed
+        return (
+            bytes((Socks5.VERSION, Socks5.CONNECT, 0)) + destination + pack("!H", port)
+        )
+
+    @staticmethod
+    async def _read(reader: asyncio.StreamReader, length: int) -> bytes:
+        try:
+            return await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise PyJARMProxyError("SOCKS5 proxy closed the connection")
+
+    @staticmethod
+    async def _read_method(reader: asyncio.StreamReader, method: int):
+        version, selected = await Socks5._read(reader, 2)
+        if version != Socks5.VERSION:
+            raise PyJARMProxyError(f"Invalid SOCKS5 version: {version}")
+        if selected != method:
+            raise PyJARMProxyError(
+                "SOCKS5 proxy requires authentication"
+                if selected == Socks5.USERNAME_PASSWORD
+                else "No acceptable SOCKS5 authentication method"
+            )
+
+    @staticmethod
+    async def _read_reply(reader: asyncio.StreamReader):
+        version, reply, _, kind = await Socks5._read(reader, 4)
+        if version != Socks5.VERSION:
+            raise PyJARMProxyError(f"Invalid SOCKS5 version: {version}")
+        if reply != 0:
+            reason = Socks5.REPLIES.get(reply, f"error {reply}")
+            if reply in Socks5.TARGET_REPLIES:
+                raise PyJARMProxyTargetError(
+                    f"SOCKS5 CONNECT failed: {reason}", Socks5.TARGET_REPLIES[reply]
+                )
+            raise PyJARMProxyError(f"SOCKS5 CONNECT failed: {reason}")
+        # Skip the bound address and port
+        if kind == Socks5.IPV4:
+            length = 4
+        elif kind == Socks5.IPV6:
+            length = 16
+        elif kind == Socks5.DOMAIN:
+            length = (await Socks5._read(reader, 1))[0]
+        else:
+            raise PyJARMProxyError(f"Invalid SOCKS5 address type: {kind}")
+        await Socks5._read(reader, length + 2)
@@ -0,0 +1,164 @@
+import asyncio
+import ipaddress
+import multiprocessing
+import time
+from typing import Any, Dict, Optional
+
+
+class SharedRateLimit:
+    """
+    A rate limit on new probe connections, shared by every process of a scan.
+
+    This is a generic cell rate algorithm over a single shared value, the theoretical
+    arrival time of the next connection, so worker processes only coordinate through
+    one lock. It must be handed to worker processes when they are created.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Initializes a rate limit.
+
+        Args:
+            rate (float):
+                The maximum number of connections per second.
+            burst (int, optional, default=1):
+                How many connections may start back to back after an idle period.
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.interval = 1.0 / rate
+        self._tat = multiprocessing.Value("d", 0.0)
+
+    def reserve(self) -> float:
+        """
+        Reserves the next connection and returns how long, in seconds, to wait before
+        starting it.
+        """
+        with self._tat.get_lock():
+            now = time.monotonic()
+            tat = self._tat.value
+            self._tat.value = max(tat, now) + self.interval
+        return max(0.0, tat - (self.burst - 1) * self.interval - now)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class TokenBucket:
+    """
+    A token bucket for a single process. Tokens are reserved ahead of time, so waiters
+    are served in order.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """
+        Takes a token and returns how long, in seconds, to wait until it is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def idle(self) -> bool:
+        """
+        Returns whether the bucket has refilled, which makes it the same as a new one.
+        """
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.burst
+
+
+class DestinationRateLimit:
+    """
+    Token bucket rate limits on new probe connections to each destination IP address and
+    to each network prefix, such as a /24, so that many targets on the same network or
+    behind the same load balancer are not probed faster than its IDS tolerates.
+
+    The limits apply within one process, use a SharedRateLimit for a global limit
+    across processes.
+    """
+
+    # Idle buckets are dropped once there are more than this many
+    MAX_BUCKETS = 10000
+
+    def __init__(
+        self,
+        per_ip: Optional[float] = None,
+        per_prefix: Optional[float] = None,
+        burst: int = 1,
+        prefix_v4: int = 24,
+        prefix_v6: int = 64,
+    ):
+        """
+        Initializes destination rate limits.
+
+        Args:
+            per_ip (float, optional):
+                The maximum number of connections per second to one IP address.
+            per_prefix (float, optional):
+                The maximum number of connections per second to one network prefix.
+            burst (int, optional, default=1):
+                How many connections may start back to back after an idle period.
+            prefix_v4 (int, optional, default=24):
+                The prefix length of IPv4 networks.
+            prefix_v6 (int, optional, default=64):
+                The prefix length of IPv6 networks.
+        """
+        for rate in (per_ip, per_prefix):
+            if rate is not None and rate <= 0:
+                raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        self.per_ip = per_ip
+        self.per_prefix = per_prefix
+        self.burst = burst
+        self.prefix_v4 = prefix_v4
+        self.prefix_v6 = prefix_v6
+        self._ips: Dict[str, TokenBucket] = {}
+        self._prefixes: Dict[Any, TokenBucket] = {}
+
+    def prefix(self, destination: str) -> Optional[Any]:
+        """
+        Returns the network prefix of an IP address, or None for a host name.
+        """
+        try:
+            address = ipaddress.ip_address(destination)
+        except ValueError:
+            return None
+        length = self.prefix_v4 if address.version == 4 else self.prefix_v6
+        return ipaddress.ip_network(f"{address}/{length}", strict=False)
+
+    async def acquire(self, destination: str):
+        """
+        Waits until a connection to destination, an IP address or, when connecting
+        through a proxy, a host name, is allowed.
+        """
+        if self.per_prefix is not None:
+            prefix = self.prefix(destination)
+            if prefix is not None:
+                await self._wait(self._prefixes, prefix, self.per_prefix)
+        if self.per_ip is not None:
+            await self._wait(self._ips, destination, self.per_ip)
+
+    async def _wait(self, buckets: Dict[Any, TokenBucket], key: Any, rate: float):
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= DestinationRateLimit.MAX_BUCKETS:
+                for idle in [k for k, b in buckets.items() if b.idle()]:
+                    del buckets[idle]
+            bucket = TokenBucket(rate, self.burst)
+            buckets[key] = bucket
+        delay = bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
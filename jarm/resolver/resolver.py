@@ -0,0 +1,109 @@
+import asyncio
+from collections import OrderedDict
+import socket
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from jarm.exceptions.exceptions import PyJARMInvalidTarget
+from jarm.validate.validate import Validate
+
+
+class Resolver:
+    """
+    Asynchronous, caching name resolver.
+
+    Lookups run through loop.getaddrinfo so they never block the event loop, results are
+    kept for ttl seconds, and concurrent lookups of the same name share one query.
+    """
+
+    _default: Optional["Resolver"] = None
+
+    def __init__(self, ttl: float = 300, max_entries: int = 65536):
+        """
+        Initializes a resolver.
+
+        Args:
+            ttl (float, optional, default=300):
+                How long, in seconds, a resolved address is cached.
+            max_entries (int, optional, default=65536):
+                The maximum number of cached names. The least recently used entry is
+                evicted first.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple[str, int, int], Tuple[float, Any]]" = (
+            OrderedDict()
+        )
+        self._inflight: Dict[Tuple[str, int, int], asyncio.Future] = {}
+
+    @staticmethod
+    def default() -> "Resolver":
+        """
+        Returns the resolver shared by every scan that does not provide its own.
+        """
+        if Resolver._default is None:
+            Resolver._default = Resolver()
+        return Resolver._default
+
+    @staticmethod
+    def numeric(host: str, port: int = 443, address_family: int = 0) -> Any:
+        """
+        Builds the address info for an IP address without querying a resolver.
+        """
+        try:
+            info = socket.getaddrinfo(
+                host=host,
+                port=port,
+                family=address_family,
+                type=socket.SOCK_STREAM,
+                flags=socket.AI_NUMERICHOST,
+            )
+        except socket.gaierror:
+            raise PyJARMInvalidTarget(f"Invalid IP address: {host}")
+        return info[0]
+
+    def clear(self):
+        self._cache.clear()
+
+    async def resolve(self, host: str, port: int = 443, address_family: int = 0) -> Any:
+        """
+        Resolves host and returns the first address info tuple, checked by
+        Validate.validate_address_info like Validate.validate_target does.
+
+        Raises:
+            PyJARMInvalidTarget: The host could not be resolved.
+        """
+        key = (host, port, address_family)
+        entry = self._cache.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                return entry[1]
+            del self._cache[key]
+
+        lookup = self._inflight.get(key)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._lookup(key))
+            self._inflight[key] = lookup
+            lookup.add_done_callback(lambda t: self._lookup_done(key, t))
+        # A cancelled caller must not cancel the lookup other callers are waiting on
+        return await asyncio.shield(lookup)
+
+    async def _lookup(self, key: Tuple[str, int, int]) -> Any:
+        host, port, address_family = key
+        loop = asyncio.get_running_loop()
+        try:
+            info = await loop.getaddrinfo(host, port, family=address_family)
+        except socket.gaierror:
+            raise PyJARMInvalidTarget("Invalid Target Host")
+        address = Validate.validate_address_info(info)
+        self._cache[key] = (time.monotonic() + self.ttl, address)
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return address
+
+    def _lookup_done(self, key: Tuple[str, int, int], lookup: asyncio.Future):
+        del self._inflight[key]
+        if not lookup.cancelled():
+            # Mark the exception as retrieved in case every caller went away
+            lookup.exception()
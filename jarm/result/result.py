@@ -0,0 +1,131 @@
+import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class ScanResult:
+    """
+    The result of scanning one target, with the pieces its JARM hash is built from.
+
+    It unpacks and indexes like the (jarm, host, port) tuple returned by default, so
+    code written for tuples keeps working. Per probe lists are in V1 order and only
+    hold the probes that completed.
+    """
+
+    __slots__ = (
+        "jarm",
+        "host",
+        "port",
+        "ip",
+        "raw",
+        "components",
+        "timings",
+        "errors",
+        "retries",
+    )
+
+    def __init__(
+        self,
+        jarm: str,
+        host: str,
+        port: int,
+        ip: Optional[str] = None,
+        raw: Optional[str] = None,
+        components: Optional[List[str]] = None,
+        timings: Optional[List[Optional[float]]] = None,
+        errors: Optional[List[Optional[str]]] = None,
+        retries: Optional[List[int]] = None,
+    ):
+        """
+        Initializes a scan result.
+
+        Args:
+            jarm (str):
+                The JARM hash.
+            host (str):
+                The target host.
+            port (int):
+                The target port.
+            ip (str, optional):
+                The IP address probes connected to, None through a proxy which resolved
+                the target.
+            raw (str, optional):
+                The raw JARM string the hash is computed from, None when the result came
+                from a cache or the target was given up on.
+            components (list<str>, optional):
+                The cipher|version|ALPN|extensions part of the raw string of each probe.
+            timings (list<float>, optional):
+                How long each probe took, in seconds.
+            errors (list<str>, optional):
+                The ProbeRecord outcome of each probe that did not succeed, None for
+                those that did.
+            retries (list<int>, optional):
+                How many times each probe was retried.
+        """
+        self.jarm = jarm
+        self.host = host
+        self.port = port
+        self.ip = ip
+        self.raw = raw
+        self.components = components or []
+        self.timings = timings or []
+        self.errors = errors or []
+        self.retries = retries or []
+
+    def as_tuple(self) -> Tuple[str, str, int]:
+        return self.jarm, self.host, self.port
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.as_tuple())
+
+    def __getitem__(self, index):
+        return self.as_tuple()[index]
+
+    def __len__(self) -> int:
+        return 3
+
+    def __eq__(self, other):
+        if isinstance(other, ScanResult):
+            return self.as_dict() == other.as_dict()
+        if isinstance(other, tuple):
+            return self.as_tuple() == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    def __repr__(self):
+        return f"ScanResult({self.as_dict()!r})"
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @staticmethod
+    def from_dict(values: Dict[str, Any]) -> "ScanResult":
+        return ScanResult(**values)
+
+    def to_json(self) -> str:
+        """
+        Returns the result as a single line of JSON.
+        """
+        return json.dumps(self.as_dict(), separators=(",", ":"))
+
+    def to_msgpack(self) -> bytes:
+        """
+        Returns the result as a msgpack map. Requires msgpack (pip install
+        pyjarm[msgpack]).
+        """
+        return ScanResult._msgpack().packb(self.as_dict())
+
+    @staticmethod
+    def from_msgpack(data: bytes) -> "ScanResult":
+        return ScanResult.from_dict(ScanResult._msgpack().unpackb(data))
+
+    @staticmethod
+    def _msgpack():
+        try:
+            import msgpack  # type: ignore
+        except ImportError:
+            raise ImportError(
+                "msgpack output requires msgpack, install it with pip install pyjarm[msgpack]"
+            )
+        return msgpack
@@ -0,0 +1,64 @@
+import random
+from typing import Optional
+
+from jarm.metrics.metrics import ProbeRecord
+
+
+class RetryPolicy:
+    """
+    Retries of single probes that failed in a way that is likely transient.
+
+    A probe that timed out, was reset or got an empty response is sent again, after a
+    jittered exponential backoff, instead of turning into a failed packet in the JARM.
+    Only the failed probe is retried.
+    """
+
+    # Outcomes worth retrying
+    TRANSIENT = (ProbeRecord.TIMEOUT, ProbeRecord.RESET, ProbeRecord.CLOSED)
+
+    def __init__(
+        self,
+        retries: int = 2,
+        budget: Optional[int] = None,
+        backoff: float = 0.25,
+        max_backoff: float = 5.0,
+    ):
+        """
+        Initializes a retry policy.
+
+        Args:
+            retries (int, optional, default=2):
+                How many times a single probe is retried.
+            budget (int, optional):
+                How many retries all probes of a target may use together. Unlimited by
+                default.
+            backoff (float, optional, default=0.25):
+                The longest wait, in seconds, before the first retry. It doubles with
+                every retry of the same probe.
+            max_backoff (float, optional, default=5.0):
+                The longest wait, in seconds, before any retry.
+        """
+        if retries < 0:
+            raise ValueError("retries must not be negative")
+        if budget is not None and budget < 0:
+            raise ValueError("budget must not be negative")
+        self.retries = retries
+        self.budget = budget
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, record: ProbeRecord, retries_left: Optional[int]) -> bool:
+        """
+        Returns whether the probe described by record should be sent again.
+        """
+        return (
+            record.outcome in RetryPolicy.TRANSIENT
+            and record.retries < self.retries
+            and (retries_left is None or retries_left > 0)
+        )
+
+    def delay(self, retry: int) -> float:
+        """
+        Returns how long to wait before the given retry of a probe, counting from 0.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**retry))
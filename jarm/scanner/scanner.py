@@ -1,19 +1,56 @@
-from collections import namedtuple
+from collections import deque, namedtuple
 import logging
 import asyncio
-from typing import Optional, List, Any
+import math
+import time
+from struct import unpack, unpack_from
+from typing import (
+    Optional,
+    List,
+    Any,
+    AsyncContextManager,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Tuple,
+    Union,
+)
 import warnings
 
-from jarm.constants import TOTAL_FAILURE, FAILED_PACKET, ERROR_INC_1, ERROR_INC_2
+from jarm.constants import (
+    TOTAL_FAILURE,
+    FAILED_PACKET,
+    ERROR_INC_1,
+    ERROR_INC_2,
+    DEFAULT_TIMEOUT,
+)
 from jarm.formats import V1
 from jarm.hashing.hashing import Hasher
+from jarm.metrics.metrics import ProbeRecord
 from jarm.packet.packet import Packet
+from jarm.packet.template import PacketTemplate
+from jarm.cache.cache import ResultCache
+from jarm.capture.capture import HelloCapture
 from jarm.connection.connection import Connection
+from jarm.exceptions.exceptions import PyJARMInvalidProxy, PyJARMTargetUnreachable
+from jarm.precheck.precheck import Precheck
+from jarm.loop.loop import EventLoop
+from jarm.proxy.proxy import ProxyConfig, ProxyPool
+from jarm.result.result import ScanResult
+from jarm.ratelimit.ratelimit import DestinationRateLimit, SharedRateLimit
+from jarm.resolver.resolver import Resolver
+from jarm.retry.retry import RetryPolicy
+from jarm.scheduler.scheduler import Scheduler
+from jarm.timeout.timeout import AdaptiveTimeout
 
 
 class Scanner:
 
-    ScanTarget = namedtuple("ScanTarget", "host port")
+    ScanTarget = namedtuple("ScanTarget", "host port ip", defaults=(None,))
+    ALPN_TYPE: int = unpack(">H", Packet.ALPN_BASE)[0]
 
     @staticmethod
     async def gather_with_concurrency(n, *tasks):
@@ -26,11 +63,13 @@ class Scanner:
         return await asyncio.gather(*(sem_task(task) for task in tasks))
 
     @staticmethod
-    def scan(*args, **kwargs):
+    def scan(*args, fast_loop: bool = False, **kwargs):
         """
         Sync version of scan that doesn't require to be called through asyncio.run()
+
+        With fast_loop the scan runs on uvloop if it is installed, see EventLoop.run.
         """
-        return asyncio.run(Scanner.scan_async(*args, **kwargs))
+        return EventLoop.run(Scanner.scan_async(*args, **kwargs), fast=fast_loop)
 
     @staticmethod
     async def scan_async(
@@ -41,8 +80,21 @@ class Scanner:
         proxy: Optional[str] = None,
         proxy_auth: Optional[str] = None,
         proxy_insecure: Optional[bool] = None,
+        proxy_pool: Optional[ProxyPool] = None,
         concurrency: int = 2,
         suppress: bool = False,
+        dest_ip: Optional[str] = None,
+        resolver: Optional[Resolver] = None,
+        fast_teardown: bool = False,
+        cache: Optional[ResultCache] = None,
+        on_probe: Optional[Callable[[ProbeRecord], Any]] = None,
+        adaptive_timeout: bool = False,
+        timeout_floor: float = 1.0,
+        deadline: Optional[float] = None,
+        fail_fast: Optional[int] = None,
+        retry: Optional[RetryPolicy] = None,
+        capture: Optional[HelloCapture] = None,
+        detailed: bool = False,
     ):
         """
         Kicks off a number of TLS hello packets to a server then parses and hashes the response.
@@ -57,150 +109,718 @@ class Scanner:
             address_family (int, optional):
                 The address family for the scan. This will default to ANY and is used to validate the target.
             proxy (str, optional):
-                The proxy server to use. Use format http[s]://username:password@proxy:port. By default the HTTPS_PROXY
-                environment variable is evaluated if proxy is not set. If you want to ignore the HTTPS_PROXY variable
-                without specifying a proxy, set this to 'ignore'. username/password are used for Basic authentication.
+                The proxy server to use. Use format http[s]://username:password@proxy:port, or socks5:// for a SOCKS5
+                proxy. By default the HTTPS_PROXY environment variable is evaluated if proxy is not set. If you want
+                to ignore the HTTPS_PROXY variable without specifying a proxy, set this to 'ignore'. username/password
+                are used for Basic authentication, or SOCKS5 username/password authentication.
             proxy_auth (str, optional):
                 Use this argument if you don't want to use username/password with Basic authentication. This value is
                 sent as us using the "Proxy-Authorization" header.
             proxy_insecure (bool, optional):
                 If you are connecting through an HTTPS proxy via TLS, this flag disables the verification of the proxy
                 certificate.
+            proxy_pool (ProxyPool, optional):
+                Connects through a proxy picked from the pool instead of proxy. All probes of the
+                target go through the same proxy, and their outcomes update its health.
             concurrency (int, optional, default=2):
                 Number of concurrent TCP connections to generate.
             suppress (bool, optional, default=False):
                 Suppresses any raised exceptions encountered during scanning
+            dest_ip (str, optional):
+                A pre-resolved IP address for dest_host. When set, dest_host is not resolved and is only
+                used for the SNI extension. Ignored when connecting through a proxy that resolves
+                targets itself, HTTP CONNECT or socks5h://.
+            resolver (Resolver, optional):
+                The resolver used for DNS lookups. Defaults to a resolver shared by all scans, which
+                caches results for five minutes.
+            fast_teardown (bool, optional, default=False):
+                Resets probe connections (SO_LINGER 0) once the ServerHello is read instead of closing
+                them gracefully, so sockets do not linger in FIN_WAIT/TIME_WAIT at high scan rates.
+            cache (ResultCache, optional):
+                A cache of previous results. A target with a fresh result for the same host, port and
+                resolved IP address is not scanned again, and new results are stored in the cache.
+            on_probe (callable, optional):
+                Called with a ProbeRecord holding the timings and outcome of every probe that
+                completes. A ProbeStats instance can be used to aggregate them.
+            adaptive_timeout (bool, optional, default=False):
+                Once a probe of the target has answered, later probes wait a few times the
+                observed round trip time instead of the full timeout, see AdaptiveTimeout.
+            timeout_floor (float, optional, default=1.0):
+                The shortest probe timeout used with adaptive_timeout.
+            deadline (float, optional):
+                The longest time, in seconds, spent on all probes of the target, counted from
+                the start of its first probe. Probes still running at the deadline fail.
+            fail_fast (int, optional):
+                Gives up on a target that looks dead instead of sending all of its probes.
+                A target is dead when a connection is refused or has no route, or after
+                this many consecutive probes timed out while connecting. Behind a proxy
+                these are the proxy's answers about the target, failures to reach the
+                proxy itself do not count. Dead targets get the TOTAL_FAILURE hash.
+                Disabled by default.
+            retry (RetryPolicy, optional):
+                Sends probes that timed out, were reset or got an empty response again. The number
+                of retries of each probe is reported in its ProbeRecord. No retries by default.
+            capture (HelloCapture, optional):
+                Appends the raw response to every probe of the target to a capture file, from
+                which HelloCapture.reparse computes the hash again offline. Targets answered from
+                the cache or given up on are not captured.
+            detailed (bool, optional, default=False):
+                Returns a ScanResult, which also holds the raw JARM string, the per probe components,
+                the resolved IP address, probe timings, errors and retries, instead of a tuple.
         Returns:
             :tuple:
                 Returns a tuple with three items. The first item is the JARM hash, which is a string. Second is
-                the target host, also a string. The final item is the target port which is an int.
+                the target host, also a string. The final item is the target port which is an int. A ScanResult,
+                which unpacks the same way, with detailed.
         Examples:
             >>> from jarm.scanner.scanner import Scanner
             >>> jarm, host, port = Scanner.scan("google.com", 443)
 
         """
-        results: List[Any] = []
+        target = Scanner.ScanTarget(dest_host, dest_port, dest_ip)
+        connect_args = Scanner._connect_args(
+            timeout=timeout,
+            address_family=address_family,
+            proxy=proxy,
+            proxy_auth=proxy_auth,
+            proxy_insecure=proxy_insecure,
+            proxy_pool=proxy_pool,
+            resolver=resolver,
+            fast_teardown=fast_teardown,
+        )
+        scan_args = Scanner._scan_args(
+            suppress=suppress,
+            cache=cache,
+            on_probe=on_probe,
+            adaptive_timeout=adaptive_timeout,
+            timeout_floor=timeout_floor,
+            deadline=deadline,
+            fail_fast=fail_fast,
+            retry=retry,
+            capture=capture,
+            detailed=detailed,
+        )
+        if suppress:
+            warnings.filterwarnings("ignore")
+        sem = asyncio.Semaphore(concurrency)
+        return await Scanner._scan_target(
+            target, connect_args, lambda ip: sem, scan_args
+        )
+
+    @staticmethod
+    async def scan_many(
+        targets: Union[Iterable[Tuple[str, int]], AsyncIterable[Tuple[str, int]]],
+        max_connections: int = 100,
+        per_host_connections: int = 2,
+        workers: Optional[int] = None,
+        timeout: int = 20,
+        address_family=Connection.AddressFamily.AF_ANY,
+        proxy: Optional[str] = None,
+        proxy_auth: Optional[str] = None,
+        proxy_insecure: Optional[bool] = None,
+        proxy_pool: Optional[ProxyPool] = None,
+        suppress: bool = False,
+        resolver: Optional[Resolver] = None,
+        fast_teardown: bool = False,
+        cache: Optional[ResultCache] = None,
+        on_probe: Optional[Callable[[ProbeRecord], Any]] = None,
+        adaptive_timeout: bool = False,
+        timeout_floor: float = 1.0,
+        deadline: Optional[float] = None,
+        fail_fast: Optional[int] = None,
+        retry: Optional[RetryPolicy] = None,
+        capture: Optional[HelloCapture] = None,
+        detailed: bool = False,
+        precheck: Optional[Precheck] = None,
+        rate_limit: Optional[SharedRateLimit] = None,
+        destination_rate_limit: Optional[DestinationRateLimit] = None,
+    ) -> AsyncIterator[Union[Tuple[str, str, int], ScanResult]]:
+        """
+        Scans many targets in a single event loop and yields results as they complete.
+
+        Every probe of every target is scheduled through one shared Scheduler, so the
+        number of open connections never exceeds max_connections no matter how many
+        targets are scanned. Targets are consumed lazily from the iterable.
+
+        Args:
+            targets (iterable<tuple> or async iterable<tuple>):
+                An iterable of (host, port) tuples to scan. A third item may carry a pre-resolved IP
+                address for the host, see dest_ip in scan_async. Probes in flight keep running
+                while an async iterable waits for more targets.
+            max_connections (int, optional, default=100):
+                The maximum number of connections open at the same time across all targets.
+            per_host_connections (int, optional, default=2):
+                The maximum number of connections open at the same time to a single target.
+            workers (int, optional):
+                The maximum number of targets scanned at the same time. By default enough targets are
+                kept in flight to fill max_connections.
+            precheck (Precheck, optional):
+                A liveness stage run ahead of the scan. Targets that do not accept a TCP connection
+                are not probed and get the TOTAL_FAILURE hash. The Precheck counts the pruned targets.
+            rate_limit (SharedRateLimit, optional):
+                Limits how many probe connections are opened per second.
+            destination_rate_limit (DestinationRateLimit, optional):
+                Limits how many probe connections are opened per second to each IP address and
+                network prefix. Probes to a throttled destination wait without holding a connection
+                slot, and more targets are taken from the iterable so that other destinations keep
+                being scanned.
+            timeout, address_family, proxy, proxy_auth, proxy_insecure, proxy_pool, suppress,
+            resolver, fast_teardown, cache, on_probe, adaptive_timeout, timeout_floor, deadline,
+            fail_fast, retry, capture, detailed:
+                See scan_async.
+        Returns:
+            :async iterator:
+                Yields a (jarm, host, port) tuple, or a ScanResult with detailed, for each target in
+                completion order.
+        Examples:
+            >>> async for jarm, host, port in Scanner.scan_many([("google.com", 443)]):
+            ...     print(jarm, host, port)
 
-        target = Scanner.ScanTarget(dest_host, dest_port)
-        connect_args = {
+        """
+        scheduler = Scheduler(
+            max_connections=max_connections,
+            per_host_connections=per_host_connections,
+            rate_limit=rate_limit,
+            destination_rate_limit=destination_rate_limit,
+        )
+        connect_args = Scanner._connect_args(
+            timeout=timeout,
+            address_family=address_family,
+            proxy=proxy,
+            proxy_auth=proxy_auth,
+            proxy_insecure=proxy_insecure,
+            proxy_pool=proxy_pool,
+            resolver=resolver,
+            fast_teardown=fast_teardown,
+        )
+        if suppress:
+            warnings.filterwarnings("ignore")
+        scan_args = Scanner._scan_args(
+            suppress=suppress,
+            cache=cache,
+            on_probe=on_probe,
+            adaptive_timeout=adaptive_timeout,
+            timeout_floor=timeout_floor,
+            deadline=deadline,
+            fail_fast=fail_fast,
+            retry=retry,
+            capture=capture,
+            detailed=detailed,
+        )
+        if workers is not None and workers < 1:
+            raise ValueError("workers must be at least 1")
+        # Keep enough targets in flight to fill the global budget, plus some queued
+        # probes so that a finished target's slots are taken over immediately.
+        window = workers or 2 * math.ceil(
+            max_connections / scheduler.per_host_connections
+        )
+        asynchronous = hasattr(targets, "__aiter__")
+        remaining: Any = (
+            targets.__aiter__() if asynchronous else iter(targets)  # type: ignore
+        )
+        scanning: set = set()
+        checking: set = set()
+        # The task taking the next target of an async iterable, and the targets it took
+        pulling: set = set()
+        pulled: Deque[Tuple] = deque()
+        exhausted = False
+        # Targets that passed the pre-check and wait to be scanned
+        alive: Deque[Scanner.ScanTarget] = deque()
+
+        async def pull():
+            return await remaining.__anext__()
+
+        def take() -> Optional[Scanner.ScanTarget]:
+            # Returns None when there are no more targets, or none yet
+            if not asynchronous:
+                try:
+                    return Scanner.ScanTarget(*next(remaining))
+                except StopIteration:
+                    return None
+            if pulled:
+                return Scanner.ScanTarget(*pulled.popleft())
+            if not exhausted and not pulling:
+                pulling.add(asyncio.ensure_future(pull()))
+            return None
+
+        async def check(target):
+            args = {**connect_args, "dest_ip": target.ip} if target.ip else connect_args
+            if proxy_pool is None:
+                return target, await precheck.check(
+                    (target.host, target.port), args, suppress
+                )
+            proxy = proxy_pool.acquire()
+            try:
+                args = {**args, "proxy_config": proxy}
+                return target, await precheck.check(
+                    (target.host, target.port), args, suppress
+                )
+            finally:
+                proxy_pool.release(proxy)
+
+        def fill():
+            # Targets held up by a destination rate limit do not count against the window
+            while len(scanning) < window + min(scheduler.throttled_hosts, window):
+                if precheck is not None:
+                    if not alive:
+                        break
+                    target = alive.popleft()
+                else:
+                    next_target = take()
+                    if next_target is None:
+                        return
+                    target = next_target
+                scanning.add(
+                    asyncio.ensure_future(
+                        Scanner._scan_target(
+                            target,
+                            connect_args,
+                            lambda ip, host=target.host: scheduler.slot(host, ip),
+                            scan_args,
+                        )
+                    )
+                )
+            # Check ahead, but do not buffer more targets than there are check slots
+            while (
+                precheck is not None
+                and len(checking) + len(alive) < precheck.max_connections
+            ):
+                next_target = take()
+                if next_target is None:
+                    return
+                checking.add(asyncio.ensure_future(check(next_target)))
+
+        try:
+            fill()
+            while scanning or checking or pulling:
+                done, _ = await asyncio.wait(
+                    scanning | checking | pulling,
+                    # Wake up to take more targets when some get throttled
+                    timeout=0.1 if destination_rate_limit else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                results = []
+                for task in done:
+                    if task in pulling:
+                        pulling.discard(task)
+                        try:
+                            pulled.append(task.result())
+                        except StopAsyncIteration:
+                            exhausted = True
+                    elif task in checking:
+                        checking.discard(task)
+                        target, open_port = task.result()
+                        if open_port:
+                            alive.append(target)
+                        else:
+                            results.append(
+                                Scanner._result(
+                                    Hasher.jarm(TOTAL_FAILURE),
+                                    target,
+                                    target.ip,
+                                    None,
+                                    [],
+                                    scan_args,
+                                )
+                            )
+                    else:
+                        scanning.discard(task)
+                        results.append(task.result())
+                fill()
+                for result in results:
+                    yield result
+        finally:
+            for task in scanning | checking | pulling:
+                task.cancel()
+
+    @staticmethod
+    def _connect_args(
+        timeout: int = 20,
+        address_family=Connection.AddressFamily.AF_ANY,
+        proxy: Optional[str] = None,
+        proxy_auth: Optional[str] = None,
+        proxy_insecure: Optional[bool] = None,
+        proxy_pool: Optional[ProxyPool] = None,
+        resolver: Optional[Resolver] = None,
+        fast_teardown: bool = False,
+    ) -> Dict[str, Any]:
+        try:
+            # Parsed once for every probe of the scan
+            proxy_config: Optional[ProxyConfig] = ProxyConfig(
+                proxy, auth=proxy_auth, verify=False if proxy_insecure else True
+            )
+        except PyJARMInvalidProxy:
+            # Parsed again by every probe, which fails the target like other errors
+            proxy_config = None
+        return {
             "address_family": address_family,
             "proxy": proxy,
             "proxy_auth": proxy_auth,
             "verify": False if proxy_insecure else True,
+            "proxy_config": proxy_config,
+            "proxy_pool": proxy_pool,
             "timeout": timeout,
+            "resolver": resolver,
+            "fast_teardown": fast_teardown,
         }
 
-        if suppress:
-            warnings.filterwarnings("ignore")
-        packet_tuples = Scanner._generate_packets(
-            dest_host=dest_host, dest_port=dest_port
+    @staticmethod
+    def _scan_args(
+        suppress: bool = False,
+        cache: Optional[ResultCache] = None,
+        on_probe: Optional[Callable[[ProbeRecord], Any]] = None,
+        adaptive_timeout: bool = False,
+        timeout_floor: float = 1.0,
+        deadline: Optional[float] = None,
+        fail_fast: Optional[int] = None,
+        retry: Optional[RetryPolicy] = None,
+        capture: Optional[HelloCapture] = None,
+        detailed: bool = False,
+    ) -> Dict[str, Any]:
+        return {
+            "suppress": suppress,
+            "cache": cache,
+            "on_probe": on_probe,
+            "adaptive_timeout": adaptive_timeout,
+            "timeout_floor": timeout_floor,
+            "deadline": deadline,
+            "fail_fast": fail_fast,
+            "retry": retry,
+            "capture": capture,
+            "detailed": detailed,
+        }
+
+    @staticmethod
+    def _emit_probe(scan_args: Dict[str, Any], record: ProbeRecord):
+        on_probe = scan_args.get("on_probe")
+        if on_probe is None:
+            return
+        try:
+            on_probe(record)
+        except Exception:
+            logging.exception("Exception in on_probe hook")
+
+    @staticmethod
+    async def _resolve_target(
+        target: "Scanner.ScanTarget", connect_args: Dict[str, Any]
+    ) -> Optional[str]:
+        """
+        Returns the IP address probes to target connect to, or None when they go through
+        a proxy which resolves the target itself.
+        """
+        proxy = Connection.proxy_config(connect_args)
+        if proxy.url is not None and not proxy.local_dns:
+            return None
+        if target.ip:
+            return target.ip
+        resolver = connect_args.get("resolver") or Resolver.default()
+        info = await resolver.resolve(
+            target.host, target.port, connect_args.get("address_family") or 0
         )
-        tasks = [
-            Connection.jarm_connect(
-                (dest_host, dest_port), connect_args, packet_tuple[1], packet_tuple[0]
-            )
-            for packet_tuple in packet_tuples
-        ]
+        return info[4][0]
+
+    @staticmethod
+    async def _scan_target(
+        target: "Scanner.ScanTarget",
+        connect_args: Dict[str, Any],
+        slot: Callable[[Optional[str]], AsyncContextManager],
+        scan_args: Dict[str, Any],
+    ):
+        """
+        Sends every JARM probe to a single target, each probe waiting on slot(ip) before
+        it opens a connection.
+        """
+        results: List[Any] = []
+        raw: Optional[str] = None
+        # Records of the completed probes
+        records: List[ProbeRecord] = []
+        tasks: List[asyncio.Future] = []
+        cache = scan_args.get("cache")
+        resolved = False
+        ip = None
+        resolve_time = None
+        timeout = connect_args.get("timeout") or DEFAULT_TIMEOUT
+        adaptive = (
+            AdaptiveTimeout(timeout, floor=scan_args.get("timeout_floor", 1.0))
+            if scan_args.get("adaptive_timeout")
+            else None
+        )
+        deadline = scan_args.get("deadline")
+        deadline_at: Optional[float] = None
+        fail_fast = scan_args.get("fail_fast")
+        connect_timeouts = 0
+        # Why the target was given up on, set once it looks dead
+        dead: Optional[str] = None
+
+        retry = scan_args.get("retry")
+        retries_left = retry.budget if retry is not None else None
+
+        # Pin every probe of the target to one proxy of the pool
+        proxy_pool = connect_args.get("proxy_pool")
+        proxy = proxy_pool.acquire() if proxy_pool is not None else None
+        if proxy is not None:
+            connect_args = {**connect_args, "proxy_config": proxy}
+        proxied = False
+
+        def emit(record):
+            records.append(record)
+            Scanner._emit_probe(scan_args, record)
+
+        async def send(packet_tuple, record):
+            nonlocal deadline_at
+            async with slot(ip):
+                if dead is not None:
+                    raise PyJARMTargetUnreachable(dead)
+                args = probe_args
+                probe_timeout = adaptive.timeout if adaptive else timeout
+                if deadline is not None:
+                    now = time.monotonic()
+                    if deadline_at is None:
+                        deadline_at = now + deadline
+                    if deadline_at <= now:
+                        # Out of time, fail the probe without sending it
+                        record.outcome = ProbeRecord.TIMEOUT
+                        record.total = 0.0
+                        return packet_tuple[0], b""
+                    probe_timeout = min(probe_timeout, deadline_at - now)
+                if probe_timeout != timeout:
+                    args = {**probe_args, "timeout": probe_timeout}
+                return await Connection.jarm_connect(
+                    (target.host, target.port),
+                    args,
+                    packet_tuple[1],
+                    packet_tuple[0],
+                    record,
+                )
+
+        async def probe(packet_tuple):
+            nonlocal connect_timeouts, dead, retries_left, resolve_time
+            attempt = 0
+            while True:
+                record = ProbeRecord(target.host, target.port, packet_tuple[0])
+                record.retries = attempt
+                error = None
+                try:
+                    check, output = await send(packet_tuple, record)
+                except PyJARMTargetUnreachable:
+                    raise
+                except Exception as e:
+                    error = e
+                if ip and resolve_time is not None:
+                    # The target is resolved once, for the first probe to finish
+                    record.resolve = resolve_time
+                    resolve_time = None
+                if proxy_pool is not None and proxy is not None:
+                    proxy_pool.report(proxy, record)
+                expired = deadline_at is not None and time.monotonic() >= deadline_at
+                if fail_fast is not None and not expired:
+                    # Behind a proxy the target is reached once the proxy tunnel is up,
+                    # failures to connect to the proxy itself say nothing about the target
+                    reached = record.proxy if proxied else record.connect
+                    if record.outcome in (
+                        ProbeRecord.REFUSED,
+                        ProbeRecord.UNREACHABLE,
+                    ) and (not proxied or record.connect is not None):
+                        dead = record.error
+                    elif (
+                        record.outcome == ProbeRecord.TIMEOUT
+                        and reached is None
+                        and (not proxied or record.connect is not None)
+                    ):
+                        connect_timeouts += 1
+                        if connect_timeouts >= fail_fast:
+                            dead = f"{connect_timeouts} consecutive connect timeouts"
+                    elif reached is not None:
+                        connect_timeouts = 0
+                    if dead is not None:
+                        emit(record)
+                        raise PyJARMTargetUnreachable(dead) from error
+                if (
+                    retry is not None
+                    and not expired
+                    and retry.should_retry(record, retries_left)
+                ):
+                    if retries_left is not None:
+                        retries_left -= 1
+                    await asyncio.sleep(retry.delay(attempt))
+                    attempt += 1
+                    continue
+                if error is not None:
+                    emit(record)
+                    raise error
+                if (
+                    adaptive is not None
+                    and record.connect is not None
+                    and record.first_byte is not None
+                ):
+                    adaptive.observe(record.connect + record.first_byte)
+                return check, output, record
+
         try:
-            result_list = await Scanner.gather_with_concurrency(concurrency, *tasks)
+            # Resolve once for all probes
+            start = time.monotonic()
+            ip = await Scanner._resolve_target(target, connect_args)
+            resolve_time = time.monotonic() - start
+            resolved = True
+            if cache is not None:
+                jarm = cache.get(target.host, target.port, ip)
+                if jarm is not None:
+                    return Scanner._result(jarm, target, ip, raw, records, scan_args)
+            proxied = Connection.proxy_config(connect_args).url is not None
+            probe_args = {**connect_args, "dest_ip": ip} if ip else connect_args
+            packet_tuples = Scanner._generate_packets(
+                dest_host=target.host, dest_port=target.port
+            )
+            tasks = [asyncio.ensure_future(probe(p)) for p in packet_tuples]
+            result_list = await asyncio.gather(*tasks)
+            responses = []
             for p in packet_tuples:
                 for r in result_list:
                     if p[0] == r[0]:
-                        results.append(Scanner._parse_server_hello(r[1], p))
+                        responses.append(r[1])
+                        parsed = Scanner._parse_server_hello(r[1], p)
+                        record = r[2]
+                        if record.outcome == ProbeRecord.OK and parsed == FAILED_PACKET:
+                            record.outcome = ProbeRecord.INVALID
+                        emit(record)
+                        results.append(parsed)
+            raw = ",".join(results)
+            jarm = Hasher.jarm(raw)
+            capture = scan_args.get("capture")
+            if capture is not None:
+                capture.write(target.host, target.port, ip, responses)
+        except PyJARMTargetUnreachable as e:
+            # The remaining probes are cancelled below
+            logging.debug(f"Skipping remaining probes of {target}: {e}")
+            for task in tasks:
+                if task.done() and not task.cancelled() and not task.exception():
+                    emit(task.result()[2])
+            jarm = Hasher.jarm(TOTAL_FAILURE)
         except Exception:
-            if not suppress:
+            if not scan_args.get("suppress"):
                 logging.exception(f"Unknown Exception scanning {target}")
-            return Hasher.jarm(TOTAL_FAILURE), target.host, target.port
-        return Hasher.jarm(",".join(results)), target.host, target.port
+            jarm = Hasher.jarm(TOTAL_FAILURE)
+        finally:
+            # Do not leave probes of a failed target holding connection slots
+            for task in tasks:
+                task.cancel()
+            if proxy_pool is not None and proxy is not None:
+                proxy_pool.release(proxy)
+        if cache is not None and resolved:
+            cache.set(target.host, target.port, ip, jarm)
+        return Scanner._result(jarm, target, ip, raw, records, scan_args)
+
+    @staticmethod
+    def _result(
+        jarm: str,
+        target: "Scanner.ScanTarget",
+        ip: Optional[str],
+        raw: Optional[str],
+        records: List[ProbeRecord],
+        scan_args: Dict[str, Any],
+    ) -> Union[Tuple[str, str, int], ScanResult]:
+        """
+        Returns the (jarm, host, port) tuple, or a ScanResult when detailed results were
+        asked for.
+        """
+        if not scan_args.get("detailed"):
+            return jarm, target.host, target.port
+        order = {f.__name__: i for i, f in enumerate(V1)}
+        records = sorted(records, key=lambda record: order.get(record.probe, 0))
+        return ScanResult(
+            jarm,
+            target.host,
+            target.port,
+            ip=ip,
+            raw=raw,
+            components=raw.split(",") if raw is not None else [],
+            timings=[record.total for record in records],
+            errors=[
+                None if record.outcome == ProbeRecord.OK else record.outcome
+                for record in records
+            ],
+            retries=[record.retries for record in records],
+        )
 
     @staticmethod
     def _generate_packets(dest_host: str, dest_port: int):
-        return [
-            (
-                f().__class__.__name__,
-                f().build_packet(dest_host=dest_host, dest_port=dest_port).build(),
-            )
-            for f in V1
-        ]
+        return [(f.__name__, PacketTemplate.for_format(f).build(dest_host)) for f in V1]
 
     @staticmethod
     def _parse_server_hello(hello, src_packet):
+        ret = Scanner._read_server_hello(hello)
+        logging.debug(f"Format Packet Results: {src_packet[0]} {ret}")
+        return ret
+
+    @staticmethod
+    def _read_server_hello(hello: Optional[bytes]) -> str:
         try:
             if hello is None:
-                logging.debug(f"Format Packet Results: {src_packet[0]} {FAILED_PACKET}")
-                return FAILED_PACKET
-            if hello[0] == 21:
-                selected_cipher = b""
-                logging.debug(f"Format Packet Results: {src_packet[0]} {FAILED_PACKET}")
                 return FAILED_PACKET
-            elif (hello[0] == 22) and (hello[5] == 2):
+            # Anything but a handshake record holding a ServerHello, including alerts (21),
+            # is a failed probe
+            if (hello[0] == 22) and (hello[5] == 2):
                 counter = hello[43]
-                selected_cipher = hello[counter + 44 : counter + 46]
-                version = hello[9:11]
-                ret = f"{selected_cipher.hex()}|{version.hex()}|{Scanner._extract_extension_info(hello, counter)}"
-                logging.debug(f"Format Packet Results: {src_packet[0]} {ret}")
-                return ret
-            else:
-                logging.debug(f"Format Packet Results: {src_packet[0]} {FAILED_PACKET}")
-                return FAILED_PACKET
+                view = memoryview(hello)
+                selected_cipher = view[counter + 44 : counter + 46]
+                version = view[9:11]
+                return f"{selected_cipher.hex()}|{version.hex()}|{Scanner._extract_extension_info(view, counter)}"
+            return FAILED_PACKET
         except Exception:
-            logging.debug(f"Format Packet Results: {src_packet[0]} {FAILED_PACKET}")
             return FAILED_PACKET
 
     @staticmethod
-    def _extract_extension_info(hello, counter):
-        try:
-            # Error handling
-            if (
-                (hello[counter + 47] == 11)
-                or (hello[counter + 50 : counter + 53] == ERROR_INC_1)
-                or (hello[82:85] == ERROR_INC_2)
-            ):
-                return FAILED_PACKET
-            count = 49 + counter
-            length = int.from_bytes(hello[counter + 47 : counter + 49], byteorder="big")
-            maximum = length + (count - 1)
-            types = []
-            values = []
-            # Collect all extension types and values for later reference
-            while count < maximum:
-                types.append(hello[count : count + 2])
+    def _extract_extension_info(hello: Union[bytes, memoryview], counter: int) -> str:
+        """
+        Walks the ServerHello extensions in place and returns the selected ALPN and the
+        hyphen separated list of extension types.
+
+        Truncated hellos are handled the same way the original slicing parser handled
+        them, so that the output for partial reads does not change.
+        """
+        size = len(hello)
+        start = counter + 47
+        # Error handling
+        if start >= size:
+            return "|"
+        if (
+            (hello[start] == 11)
+            or (hello[counter + 50 : counter + 53] == ERROR_INC_1)
+            or (hello[82:85] == ERROR_INC_2)
+        ):
+            return FAILED_PACKET
+        if start + 2 <= size:
+            (length,) = unpack_from(">H", hello, start)
+        else:
+            length = hello[start]
+        count = start + 2
+        maximum = length + (count - 1)
+        types: List[str] = []
+        alpn: Optional[Tuple[int, int]] = None
+        while count < maximum:
+            if count + 4 <= size:
+                ext_type, ext_length = unpack_from(">HH", hello, count)
+                types.append(f"{ext_type:04x}")
+            elif count >= size:
+                # Past the end of the data every remaining extension is empty
+                types.extend([""] * ((maximum - count + 3) // 4))
+                break
+            else:
+                # Truncated extension header
+                ext_type = (
+                    unpack_from(">H", hello, count)[0] if count + 2 <= size else -1
+                )
+                types.append(hello[count : count + 2].hex())
                 ext_length = int.from_bytes(
                     hello[count + 2 : count + 4], byteorder="big"
                 )
+            if ext_type == Scanner.ALPN_TYPE and alpn is None:
+                alpn = (count + 4, count + 4 + ext_length)
                 if ext_length == 0:
-                    count += 4
-                    values.append("")
-                else:
-                    values.append(hello[count + 4 : count + 4 + ext_length])
-                    count += ext_length + 4
-            # Read application_layer_protocol_negotiation
-            alpn = Scanner._find_extension(Packet.ALPN_BASE, types, values)
-            result = f"{str(alpn)}|"
-            # Add formating hyphens
-            add_hyphen = 0
-            while add_hyphen < len(types):
-                result += types[add_hyphen].hex()
-                add_hyphen += 1
-                if add_hyphen == len(types):
-                    break
-                else:
-                    result += "-"
-            return result
-        except IndexError:
-            return "|"
-
-    @staticmethod
-    def _find_extension(ext_type, types, values):
-        iter = 0
-        if ext_type == Packet.ALPN_BASE:
-            while iter < len(types):
-                if types[iter] == ext_type:
-                    return (values[iter][3:]).decode()
-                iter += 1
-        else:
-            while iter < len(types):
-                if types[iter] == ext_type:
-                    return values[iter].hex()
-                iter += 1
-        return ""
+                    raise ValueError("Empty application_layer_protocol_negotiation")
+            count += ext_length + 4
+        # Skip the protocol list length and the protocol name length
+        selected_alpn = (
+            "" if alpn is None else str(hello[alpn[0] + 3 : alpn[1]], "utf-8")
+        )
+        return f"{selected_alpn}|{'-'.join(types)}"
@@ -0,0 +1,99 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from jarm.ratelimit.ratelimit import DestinationRateLimit, SharedRateLimit
+
+
+class Scheduler:
+    """
+    Connection scheduler shared by every probe of every target in a scan.
+
+    The scheduler enforces a global budget of open connections as well as a per
+    host budget so that a single target can never take all of the global slots.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        per_host_connections: int = 2,
+        rate_limit: Optional[SharedRateLimit] = None,
+        destination_rate_limit: Optional[DestinationRateLimit] = None,
+    ):
+        """
+        Initializes a scheduler.
+
+        Args:
+            max_connections (int, optional, default=100):
+                The maximum number of probe connections open at the same time.
+            per_host_connections (int, optional, default=2):
+                The maximum number of probe connections open at the same time to a
+                single target.
+            rate_limit (SharedRateLimit, optional):
+                Limits how fast new connections are opened, across processes.
+            destination_rate_limit (DestinationRateLimit, optional):
+                Limits how fast new connections are opened to each destination IP
+                address and network prefix.
+        """
+        if max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+        if per_host_connections < 1:
+            raise ValueError("per_host_connections must be at least 1")
+        self.max_connections = max_connections
+        self.per_host_connections = min(per_host_connections, max_connections)
+        self.rate_limit = rate_limit
+        self.destination_rate_limit = destination_rate_limit
+        self._global = asyncio.Semaphore(max_connections)
+        # host key -> [semaphore, number of probes holding or waiting on it]
+        self._hosts: Dict[Any, List[Any]] = {}
+        # host key -> number of probes waiting on the destination rate limit
+        self._throttled: Dict[Any, int] = {}
+
+    @property
+    def throttled_hosts(self) -> int:
+        """
+        The number of hosts with probes waiting on the destination rate limit.
+        """
+        return len(self._throttled)
+
+    @asynccontextmanager
+    async def slot(
+        self, host_key: Any, destination: Optional[str] = None
+    ) -> AsyncIterator[None]:
+        """
+        Waits for a free connection slot for host_key, whose connections go to
+        destination, its IP address if known.
+
+        The per host slot is taken first so that probes waiting on a busy host do not
+        hold on to a global slot, and so are the rate limits, so that a throttled
+        destination does not hold up probes to other destinations.
+        """
+        entry = self._hosts.get(host_key)
+        if entry is None:
+            entry = [asyncio.Semaphore(self.per_host_connections), 0]
+            self._hosts[host_key] = entry
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                limit = self.destination_rate_limit
+                if limit is not None:
+                    await self._throttle(limit, host_key, destination or str(host_key))
+                if self.rate_limit is not None:
+                    await self.rate_limit.acquire()
+                async with self._global:
+                    yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._hosts[host_key]
+
+    async def _throttle(
+        self, limit: DestinationRateLimit, host_key: Any, destination: str
+    ):
+        self._throttled[host_key] = self._throttled.get(host_key, 0) + 1
+        try:
+            await limit.acquire(destination)
+        finally:
+            self._throttled[host_key] -= 1
+            if self._throttled[host_key] == 0:
+                del self._throttled[host_key]
@@ -0,0 +1,243 @@
+import asyncio
+from collections import deque
+import copy
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import os
+import queue
+import threading
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from jarm.connection.connection import Connection
+from jarm.exceptions.exceptions import PyJARMUnexpectedException
+from jarm.loop.loop import EventLoop
+from jarm.ratelimit.ratelimit import SharedRateLimit
+from jarm.result.result import ScanResult
+from jarm.scanner.scanner import Scanner
+
+
+class ShardedScanner:
+    """
+    Spreads a scan over several worker processes, so that building, parsing and hashing
+    packets is not limited to a single core.
+
+    Each worker runs its own event loop and Scanner.scan_many. Targets are handed out in
+    chunks from one shared queue, so a worker that finishes early takes more work, and
+    results are sent back to the calling process.
+    """
+
+    # Messages sent by the workers
+    RESULT = 0
+    DONE = 1
+    ERROR = 2
+
+    # Arguments of scan_many holding statistics that are merged back from the workers
+    MERGED = ("on_probe", "precheck", "proxy_pool")
+
+    @staticmethod
+    def scan(
+        targets: Iterable[Tuple[str, int]],
+        processes: Optional[int] = None,
+        ordered: bool = False,
+        chunk_size: int = 64,
+        rate_limit: Optional[SharedRateLimit] = None,
+        fast_loop: bool = False,
+        **kwargs: Any,
+    ) -> Iterator[Union[Tuple[str, str, int], ScanResult]]:
+        """
+        Scans targets in worker processes and yields the results.
+
+        Args:
+            targets (iterable<tuple>):
+                An iterable of (host, port) tuples to scan, see Scanner.scan_many. It is
+                consumed lazily in a background thread.
+            processes (int, optional):
+                The number of worker processes. Defaults to the number of CPUs.
+            ordered (bool, optional, default=False):
+                Yields results in the order of targets instead of completion order.
+            chunk_size (int, optional, default=64):
+                How many targets are handed to a worker at a time.
+            rate_limit (SharedRateLimit, optional):
+                Limits how many probe connections all of the workers open per second.
+            fast_loop (bool, optional, default=False):
+                Runs the workers' event loops on uvloop if it is installed, see
+                EventLoop.run.
+            **kwargs:
+                Any other argument of Scanner.scan_many. Every worker gets its own copy; ProbeStats, Precheck and ProxyPool statistics are
+                merged back when the workers finish, as are the workers'
+                Connection.socket_metrics.
+                max_connections applies to each worker.
+        Returns:
+            :iterator:
+                Yields a (jarm, host, port) tuple, or a ScanResult with detailed, for each
+                target.
+        Examples:
+            >>> for jarm, host, port in ShardedScanner.scan(targets, processes=4):
+            ...     print(jarm, host, port)
+
+        """
+        processes = processes or os.cpu_count() or 1
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        ctx = multiprocessing.get_context()
+        inbox = ctx.Queue(maxsize=2 * processes)
+        outbox = ctx.Queue()
+        # Forked workers inherit the caller's objects instead of unpickling copies
+        fork = ctx.get_start_method() == "fork"
+        workers = [
+            ctx.Process(
+                target=ShardedScanner._worker,
+                args=(inbox, outbox, kwargs, rate_limit, fast_loop, fork),
+                daemon=True,
+            )
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        feed_errors: List[BaseException] = []
+        feeder = threading.Thread(
+            target=ShardedScanner._feed,
+            args=(targets, inbox, chunk_size, processes, feed_errors),
+            daemon=True,
+        )
+        feeder.start()
+
+        try:
+            finished = 0
+            next_index = 0
+            # Results that arrived before an earlier target finished, when ordered
+            waiting: Dict[int, Union[Tuple[str, str, int], ScanResult]] = {}
+            while finished < processes:
+                try:
+                    message = outbox.get(timeout=1)
+                except queue.Empty:
+                    for worker in workers:
+                        if worker.exitcode not in (None, 0):
+                            raise PyJARMUnexpectedException(
+                                f"Scan worker exited with code {worker.exitcode}"
+                            )
+                    continue
+                if message[0] == ShardedScanner.RESULT:
+                    _, index, result = message
+                    if not ordered:
+                        yield result
+                        continue
+                    waiting[index] = result
+                    while next_index in waiting:
+                        yield waiting.pop(next_index)
+                        next_index += 1
+                elif message[0] == ShardedScanner.DONE:
+                    finished += 1
+                    ShardedScanner._merge(kwargs, message[1])
+                    Connection.socket_metrics.merge(message[2])
+                else:
+                    raise PyJARMUnexpectedException(f"Scan worker failed: {message[1]}")
+            feeder.join()
+            if feed_errors:
+                raise feed_errors[0]
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+    @staticmethod
+    def _feed(
+        targets: Iterable[Tuple[str, int]],
+        inbox: Any,
+        chunk_size: int,
+        processes: int,
+        errors: List[BaseException],
+    ):
+        """
+        Puts numbered chunks of targets on the queue, then one stop marker per worker.
+        """
+        chunk: List[Tuple[int, Tuple[str, int]]] = []
+        try:
+            for index, target in enumerate(targets):
+                chunk.append((index, target))
+                if len(chunk) == chunk_size:
+                    inbox.put(chunk)
+                    chunk = []
+            if chunk:
+                inbox.put(chunk)
+        except BaseException as e:
+            errors.append(e)
+        for _ in range(processes):
+            inbox.put(None)
+
+    @staticmethod
+    def _worker(
+        inbox: Any,
+        outbox: Any,
+        kwargs: Dict[str, Any],
+        rate_limit: Optional[SharedRateLimit],
+        fast_loop: bool = False,
+        fork: bool = False,
+    ):
+        # The worker's own copy of the arguments, closed when it is done
+        own: Dict[str, Any] = {}
+        try:
+            # Copied the way pickling would when forked, so that caches and captures
+            # open their own connection and file rather than share the caller's
+            own = copy.deepcopy(kwargs) if fork else kwargs
+            EventLoop.run(
+                ShardedScanner._work(inbox, outbox, own, rate_limit), fast=fast_loop
+            )
+            stats = {name: own.get(name) for name in ShardedScanner.MERGED}
+            outbox.put((ShardedScanner.DONE, stats, Connection.socket_metrics))
+        except BaseException as e:
+            outbox.put((ShardedScanner.ERROR, repr(e)))
+        finally:
+            for name in ("cache", "capture"):
+                if own.get(name) is not None:
+                    own[name].close()
+
+    @staticmethod
+    async def _work(
+        inbox: Any,
+        outbox: Any,
+        kwargs: Dict[str, Any],
+        rate_limit: Optional[SharedRateLimit],
+    ):
+        # Indexes of the targets in flight, by host and port
+        indexes: Dict[Tuple[str, int], Deque[int]] = {}
+        loop = asyncio.get_running_loop()
+        # Not the default executor, whose shutdown would wait for a pending get
+        executor = ThreadPoolExecutor(max_workers=1)
+
+        async def targets():
+            while True:
+                # Waits in a thread, so the probes in flight keep running when the
+                # targets come in slowly
+                chunk = await loop.run_in_executor(executor, inbox.get)
+                if chunk is None:
+                    return
+                for index, target in chunk:
+                    indexes.setdefault((target[0], target[1]), deque()).append(index)
+                    yield target
+
+        try:
+            async for result in Scanner.scan_many(
+                targets(), rate_limit=rate_limit, **kwargs
+            ):
+                key = (result[1], result[2])
+                pending = indexes[key]
+                index = pending.popleft()
+                if not pending:
+                    del indexes[key]
+                outbox.put((ShardedScanner.RESULT, index, result))
+        finally:
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _merge(kwargs: Dict[str, Any], stats: Dict[str, Any]):
+        """
+        Merges the statistics gathered by a worker into the caller's instances.
+        """
+        for name in ShardedScanner.MERGED:
+            local = kwargs.get(name)
+            if local is not None and hasattr(local, "merge"):
+                local.merge(stats[name])
@@ -0,0 +1,50 @@
+from typing import Optional
+
+
+class AdaptiveTimeout:
+    """
+    Per target probe timeout derived from the round trip times observed on that target.
+
+    Until a probe of the target has completed, probes use the configured timeout. After
+    that, each new probe waits multiplier times the slowest observed round trip (connect
+    plus time to first byte), bounded by floor and ceiling.
+    """
+
+    def __init__(
+        self,
+        timeout: float,
+        floor: float = 1.0,
+        ceiling: Optional[float] = None,
+        multiplier: float = 4.0,
+    ):
+        """
+        Initializes an adaptive timeout for one target.
+
+        Args:
+            timeout (float):
+                The timeout used before any round trip time is known.
+            floor (float, optional, default=1.0):
+                The shortest timeout ever used.
+            ceiling (float, optional):
+                The longest timeout ever used. Defaults to timeout.
+            multiplier (float, optional, default=4.0):
+                How many round trip times a probe may take.
+        """
+        self.default = timeout
+        self.floor = min(floor, timeout)
+        self.ceiling = timeout if ceiling is None else ceiling
+        self.multiplier = multiplier
+        self.rtt: Optional[float] = None
+
+    def observe(self, rtt: float):
+        """
+        Records the round trip time of a completed probe.
+        """
+        if self.rtt is None or rtt > self.rtt:
+            self.rtt = rtt
+
+    @property
+    def timeout(self) -> float:
+        if self.rtt is None:
+            return self.default
+        return max(self.floor, min(self.ceiling, self.rtt * self.multiplier))
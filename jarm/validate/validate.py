@@ -11,6 +11,13 @@ class Validate:
             )
         except socket.gaierror:
             raise PyJARMInvalidTarget("Invalid Target Host")
+        return Validate.validate_address_info(info)
+
+    @staticmethod
+    def validate_address_info(info):
+        """
+        Returns the first address info tuple of a getaddrinfo result.
+        """
         if info and isinstance(info, list):
             return info[0]
         raise PyJARMInvalidTarget("Invalid Target Host")
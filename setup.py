@@ -30,10 +30,11 @@ setup(
         "Programming Language :: Python :: 3.8",
     ],
     keywords="expanse, palo alto, jarm",
-    packages=[*find_packages(exclude=["tests"])],
+    packages=[*find_packages(exclude=["tests", "benchmarks"])],
     package_dir={"pyjarm": "jarm"},
     entry_points={"console_scripts": ["pyjarm=jarm.cli:run"]},
     install_requires=[],
+    extras_require={"fast": ["uvloop"], "msgpack": ["msgpack"]},
     include_package_data=True,
     python_requires=">=3.7",
 )
@@ -0,0 +1,12 @@
+import pytest
+from mocket import Mocket
+
+
+@pytest.fixture(autouse=True)
+def disable_mocket(mocker):
+    # Mocket stays enabled once a test turns it on, reset it so recordings
+    # from one test do not leak into the next. Requesting mocker first makes
+    # this run before mocker undoes its patches, otherwise Mocket would put
+    # the mocks back in place of the real socket functions.
+    yield
+    Mocket.disable()